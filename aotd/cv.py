@@ -9,16 +9,8 @@ import cv2 as cv2
 import numpy as np
 
 
-def vectors_to_commands(x_vectors, y_vectors, size_diff, center, rad=50, n_points=100, z_scale=1):
-    x_bounds = max(0, center[1] - rad), min(x_vectors.shape[1], center[1] + rad)
-    y_bounds = max(0, center[0] - rad), min(x_vectors.shape[1], center[0] + rad)
-
-    # x_vectors = x_vectors[max(0, x_bounds[0]):x_bounds[1], max(0, y_bounds[0]):y_bounds[1]]
-    # y_vectors = y_vectors[max(0, x_bounds[0]):x_bounds[1], max(0, y_bounds[0]):y_bounds[1]]
-
-    # x_vectors = x_vectors.flatten()
-    # y_vectors = y_vectors.flatten()
-
+def vectors_to_commands(x_vectors, y_vectors, size_diff, z_scale=1):
+    # the vectors cover only the region to steer by, roi_optical_flow crops them around the code
     avg_x = np.average(x_vectors)
     avg_y = np.average(y_vectors)
 
@@ -45,15 +37,191 @@ def vectors_to_commands(x_vectors, y_vectors, size_diff, center, rad=50, n_point
     return avg_x, avg_y, z_command
 
 
+class FrameCache(object):
+    """A video frame with its grayscale and pyrDown levels, each computed once on first use."""
+    __slots__ = ('bgr', 'levels')
+
+    def __init__(self, bgr):
+        self.bgr = bgr
+        self.levels = [bgr if bgr.ndim == 2 else None]
+
+    @property
+    def gray(self):
+        return self.level(0)
+
+    def level(self, n):
+        """The grayscale downsampled n times by cv2.pyrDown."""
+        levels = self.levels
+        if levels[0] is None:
+            levels[0] = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        while len(levels) <= n:
+            levels.append(cv2.pyrDown(levels[-1]))
+        return levels[n]
+
+
+def as_frame_cache(frame):
+    """frame if it already is a FrameCache, otherwise a new one around the image."""
+    return frame if isinstance(frame, FrameCache) else FrameCache(frame)
+
+
+_qr_detector = None
+
+
 def detect_qr(frame):
+    global _qr_detector
+    if _qr_detector is None:
+        _qr_detector = cv2.QRCodeDetector()
     info, decode_frame = None, None
-    qr_detector = cv2.QRCodeDetector()
-    detected, points = qr_detector.detect(frame)
+    gray = as_frame_cache(frame).gray
+    detected, points = _qr_detector.detect(gray)
     if points is not None:
-        info, decode_frame = qr_detector.decode(frame, points)
+        info, decode_frame = _qr_detector.decode(gray, points)
     return detected, points, info, decode_frame
 
 
+class QRTracker(object):
+    """
+    Stateful detect_qr for a video stream: searches around the last corners on a
+    downsampled grayscale level, falls back to the whole frame after max_misses
+    misses and decodes only when the payload is unknown or the code moved a lot.
+    track() returns the same tuple as detect_qr.
+    """
+    REFINE_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 20, 0.01)
+
+    def __init__(self, margin=0.5, max_misses=3, redecode=0.25, min_roi=64,
+                 min_size=90, max_level=2, search_levels=(1, 0), refine_window=5):
+        self.detector = cv2.QRCodeDetector()
+        self.margin = margin
+        self.max_misses = max_misses
+        self.redecode = redecode
+        self.min_roi = min_roi
+        self.min_size = min_size
+        self.max_level = max_level
+        self.search_levels = search_levels
+        self.refine_window = refine_window
+        self.points = None
+        self.info = None
+        self.decoded_points = None
+        self.modules = None
+        self.level = 0
+        self.misses = 0
+        self.roi_searches = 0
+        self.full_searches = 0
+        self.decodes = 0
+
+    def reset(self):
+        self.points = None
+        self.info = None
+        self.decoded_points = None
+        self.modules = None
+        self.misses = 0
+
+    def track(self, frame):
+        frame = as_frame_cache(frame)
+        gray = frame.gray
+        points, origin, region = None, (0, 0), gray
+        if self.points is not None:
+            origin, region = self.__roi(gray)
+            self.level = self.__level()
+            self.roi_searches += 1
+            points = self.__detect(region, self.level)
+            if points is None:
+                self.misses += 1
+                if self.misses < self.max_misses:
+                    return False, None, self.info, None
+                self.reset()
+                origin, region = (0, 0), gray
+        if points is None:
+            # no area to pick a level from, alternate between the search levels
+            self.level = self.search_levels[self.full_searches % len(self.search_levels)]
+            self.full_searches += 1
+            points = self.__detect(region, self.level, frame)
+            if points is None:
+                return False, None, None, None
+
+        self.misses = 0
+        decode_frame = None
+        if not self.info or self.__moved(points + origin):
+            info, decode_frame = self.detector.decode(region, points)
+            self.decodes += 1
+            if info:
+                self.info = info
+                self.decoded_points = points + origin
+                self.modules = decode_frame.shape[0]
+        self.points = points + origin
+        return True, self.points, self.info, decode_frame
+
+    def __level(self):
+        # the coarsest pyramid level where the code side is still at least min_size pixels
+        corners = self.points[0]
+        side = np.sqrt(poly_area(corners[:, 0], corners[:, 1]))
+        level = 0
+        while level < self.max_level and self.min_size <= side / (2 << level):
+            level += 1
+        return level
+
+    def __detect(self, image, level, frame=None):
+        if frame is not None:
+            small = frame.level(level)
+        else:
+            small = image
+            for _ in range(level):
+                small = cv2.pyrDown(small)
+        detected, points = self.detector.detect(small)
+        if not detected or points is None:
+            return None
+        points = points.reshape(4, 2).astype(np.float32)
+        if level and np.sqrt(poly_area(points[:, 0], points[:, 1])) < 0.75 * self.min_size:
+            # too small to trust at this level, most likely a false match
+            return self.__detect(image, level - 1, frame)
+        if level:
+            points = self.__refine(image, points * (1 << level), 1 << level)
+        return points.reshape(1, 4, 2)
+
+    def __refine(self, image, points, scale):
+        # points were found scale times smaller, cornerSubPix moves them onto the full resolution corners.
+        # the window must not reach the next module edge, a version 1 code has 21 modules
+        module = np.sqrt(poly_area(points[:, 0], points[:, 1])) / (self.modules or 21)
+        half = int(min(self.refine_window, max(2, module / 2 - 1)))
+        window = (half, half)
+        if self.modules is None:
+            refined = cv2.cornerSubPix(image, points.reshape(-1, 1, 2).copy(), window, (-1, -1),
+                                       self.REFINE_CRITERIA).reshape(4, 2)
+            # corners 0, 1 and 3 sit on finder patterns, corner 2 is an estimate without a corner to lock on to.
+            # until a decode gives the module count, nudge it towards the parallelogram of the other three
+            # by at most one pixel of the pyramid level
+            refined[2] = points[2] + np.clip(refined[1] + refined[3] - refined[0] - points[2], -scale, scale)
+            return refined
+
+        # with the module count known, corner 2 comes from a homography fitted to the outer corners and
+        # the finder pattern corners bordering the quiet zone, given here in module coordinates
+        n = self.modules
+        square = np.float32([[0, 0], [n, 0], [n, n], [0, n]])
+        anchors = np.float32([[0, 0], [n, 0], [0, n], [7, 0], [0, 7], [n - 7, 0], [n, 7], [7, n], [0, n - 7]])
+        guess = cv2.perspectiveTransform(anchors[None], cv2.getPerspectiveTransform(square, points))[0]
+        refined = cv2.cornerSubPix(image, guess.reshape(-1, 1, 2).copy(), window, (-1, -1), self.REFINE_CRITERIA)
+        homography, _ = cv2.findHomography(anchors, refined, cv2.RANSAC, scale)
+        if homography is None:
+            return points
+        return cv2.perspectiveTransform(square[None], homography)[0]
+
+    def __roi(self, frame):
+        height, width = frame.shape[:2]
+        corners = self.points[0]
+        (x0, y0), (x1, y1) = corners.min(axis=0), corners.max(axis=0)
+        pad = max(self.margin * max(x1 - x0, y1 - y0), self.min_roi / 2)
+        x0, y0 = max(0, int(x0 - pad)), max(0, int(y0 - pad))
+        x1, y1 = min(width, int(x1 + pad) + 1), min(height, int(y1 + pad) + 1)
+        return np.array((x0, y0), dtype=np.float32), frame[y0:y1, x0:x1]
+
+    def __moved(self, points):
+        if self.decoded_points is None:
+            return True
+        corners = self.decoded_points[0]
+        size = max(np.ptp(corners, axis=0).max(), 1.0)
+        return self.redecode * size < np.abs(points[0] - corners).max()
+
+
 def poly_area(x, y):
     x_term = np.dot(x, np.roll(y, 1))
     y_term = np.dot(y, np.roll(x, 1))
@@ -63,9 +231,9 @@ def poly_area(x, y):
 def dense_optical_flow(prev_frame, curr_frame, params=None):
     if not params:
         params = [0.5, 3, 15, 3, 5, 1.2, 0]
-    # Preprocessing for exact method
-    prev_frame = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-    curr_frame = cv2.cvtColor(curr_frame, cv2.COLOR_BGR2GRAY)
+    # Preprocessing for exact method, FrameCaches keep the gray of the previous call
+    prev_frame = as_frame_cache(prev_frame).gray
+    curr_frame = as_frame_cache(curr_frame).gray
 
     # Calculate Optical Flow
     flow = cv2.calcOpticalFlowFarneback(prev_frame, curr_frame, None, *params)
@@ -73,6 +241,84 @@ def dense_optical_flow(prev_frame, curr_frame, params=None):
     return flow, x_vect, y_vect
 
 
+def flow_roi(center, rad, shape, pad=15):
+    """(x0, y0, x1, y1) of the square reaching rad + pad pixels from center, clipped to shape."""
+    height, width = shape[:2]
+    x = min(max(int(center[0]), 0), width - 1)
+    y = min(max(int(center[1]), 0), height - 1)
+    reach = int(rad + pad)
+    return max(0, x - reach), max(0, y - reach), min(width, x + reach + 1), min(height, y + reach + 1)
+
+
+def roi_optical_flow(prev_frame, curr_frame, roi, params=None):
+    """dense_optical_flow on the roi = (x0, y0, x1, y1) only; also returns the clipped roi."""
+    prev_gray = as_frame_cache(prev_frame).gray
+    curr_gray = as_frame_cache(curr_frame).gray
+    height, width = curr_gray.shape
+    x0, y0, x1, y1 = roi
+    x0, y0 = max(0, int(x0)), max(0, int(y0))
+    x1, y1 = min(width, int(x1)), min(height, int(y1))
+    flow, x_vect, y_vect = dense_optical_flow(prev_gray[y0:y1, x0:x1], curr_gray[y0:y1, x0:x1], params)
+    return flow, x_vect, y_vect, (x0, y0, x1, y1)
+
+
+def roi_flow_to_frame(flow, roi, shape):
+    """The flow of roi_optical_flow placed in a full frame field of shape, zero outside the roi."""
+    x0, y0, x1, y1 = roi
+    field = np.zeros(shape[:2] + (2,), dtype=flow.dtype)
+    field[y0:y1, x0:x1] = flow
+    return field
+
+
+class SparseFlow(object):
+    """Pyramidal Lucas-Kanade on tracked points, a sparse replacement for dense_optical_flow."""
+
+    def __init__(self, max_corners=100, quality=0.01, min_distance=10, min_points=20, win_size=21, max_level=3):
+        self.max_corners = max_corners
+        self.quality = quality
+        self.min_distance = min_distance
+        self.min_points = min_points
+        self.win_size = (win_size, win_size)
+        self.max_level = max_level
+        self.criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+        self.prev_gray = None
+        self.prev_points = None
+
+    def reset(self):
+        self.prev_gray = None
+        self.prev_points = None
+
+    def update(self, frame, track_points=None):
+        """(prev_points, next_points) of the points tracked into frame; track_points replaces the next ones."""
+        gray = as_frame_cache(frame).gray
+        prev_points = next_points = np.empty((0, 2), dtype=np.float32)
+        if self.prev_gray is not None and self.prev_points is not None and len(self.prev_points):
+            tracked, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, self.prev_points, None,
+                                                          winSize=self.win_size, maxLevel=self.max_level,
+                                                          criteria=self.criteria)
+            found = status.ravel() == 1
+            prev_points, next_points = self.prev_points[found].reshape(-1, 2), tracked[found].reshape(-1, 2)
+
+        if track_points is not None:
+            self.prev_points = np.asarray(track_points, dtype=np.float32).reshape(-1, 1, 2)
+        elif len(next_points) < self.min_points:
+            self.prev_points = cv2.goodFeaturesToTrack(gray, self.max_corners, self.quality, self.min_distance)
+        else:
+            self.prev_points = next_points.reshape(-1, 1, 2)
+        self.prev_gray = gray
+        return prev_points, next_points
+
+
+def flow_to_commands(prev_points, next_points, size_diff, z_scale=1):
+    """The (avg_x, avg_y, z) of vectors_to_commands from sparse tracks."""
+    if len(next_points):
+        avg_x, avg_y = np.mean(next_points - prev_points, axis=0)
+    else:
+        avg_x, avg_y = 0.0, 0.0
+    z_command = 1 - (size_diff * z_scale)
+    return avg_x, avg_y, z_command
+
+
 def draw_text(img, text, font=cv2.FONT_HERSHEY_PLAIN, pos=(0, 0), font_scale=3, font_thickness=2,
               text_color=(0, 255, 0), text_color_bg=(0, 0, 0)):
     x, y = pos
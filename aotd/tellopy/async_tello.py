@@ -0,0 +1,203 @@
+import asyncio
+import time
+
+from . import error, recorder
+from .protocol import *
+from .tello import Tello, log
+
+
+class DatagramHandler(asyncio.DatagramProtocol):
+    """Passes every datagram received on an endpoint to a callback."""
+
+    def __init__(self, callback, name):
+        self.callback = callback
+        self.name = name
+        # done once the socket is really closed, transport.close() only schedules it
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def connection_lost(self, exc):
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def datagram_received(self, data, addr):
+        try:
+            self.callback(data)
+        except Exception as ex:
+            log.error('%s: %s' % (self.name, str(ex)))
+            show_exception(ex)
+
+    def error_received(self, exc):
+        log.info('%s: %s' % (self.name, str(exc)))
+
+
+class AsyncTello(Tello):
+    """
+    Tello client running on an asyncio event loop instead of its own threads.
+    Packets, events and the connection state machine are the same as Tello's; the
+    sockets, timeouts and stick commands are driven by the loop, so any number of
+    drones can share one loop with the rest of the application.
+    """
+    RECV_TIMEOUT = 2.0
+    VIDEO_TIMEOUT = 1.0
+
+    def __init__(self, port=9000, stick_rate=50.0, tello_addr=('192.168.10.1', 8889), video_port=6038,
+                 local_host='0.0.0.0'):
+        Tello.__init__(self, port, stick_rate, start_threads=False,
+                       tello_addr=tello_addr, video_port=video_port, local_host=local_host)
+        self.transport = None
+        self.video_transport = None
+        self.handlers = []
+        self.tasks = []
+        self.queues = []
+        self.last_recv = 0.0
+        self.last_video_recv = 0.0
+        self.connected_event = None
+
+    async def connect(self, timeout=None):
+        """Connect opens the sockets on the running loop and waits until the drone answers."""
+        loop = asyncio.get_running_loop()
+        self.connected_event = asyncio.Event()
+        self.subscribe(self.EVENT_CONNECTED, self.__handle_event)
+        self.subscribe(self.EVENT_DISCONNECTED, self.__handle_event)
+
+        self.transport, handler = await loop.create_datagram_endpoint(
+            lambda: DatagramHandler(self.__recv, 'recv'), local_addr=(self.local_host, self.port))
+        self.handlers.append(handler)
+        self.video_transport, handler = await loop.create_datagram_endpoint(
+            lambda: DatagramHandler(self.__video_recv, 'video recv'), local_addr=(self.local_host, self.video_port))
+        self.handlers.append(handler)
+        self.last_recv = self.last_video_recv = time.monotonic()
+        self.tasks = [
+            loop.create_task(self.stick_scheduler.run_async()),
+            loop.create_task(self.__watch_timeouts()),
+        ]
+
+        Tello.connect(self)
+        try:
+            await asyncio.wait_for(self.connected_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            # leave nothing bound or running, so connect() can be retried
+            await self.__close()
+            raise error.TelloError('timeout')
+
+    async def takeoff(self):
+        """Takeoff tells the drones to liftoff and start flying."""
+        return Tello.takeoff(self)
+
+    async def land(self):
+        """Land tells the drone to come in for landing."""
+        return Tello.land(self)
+
+    async def quit(self):
+        """Quit stops the loop tasks, closes the sockets and ends all data iterators."""
+        Tello.quit(self)
+        await self.__close()
+        for queue in self.queues:
+            self.__put_latest(queue, None)
+
+    async def __close(self):
+        self.unsubscribe(self.EVENT_CONNECTED, self.__handle_event)
+        self.unsubscribe(self.EVENT_DISCONNECTED, self.__handle_event)
+        self.stick_scheduler.stop()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for transport in (self.transport, self.video_transport):
+            if transport is not None:
+                transport.close()
+        self.transport = self.video_transport = None
+        await asyncio.gather(*(handler.closed for handler in self.handlers))
+        self.handlers = []
+
+    def send_packet(self, pkt):
+        """Send_packet is used to send a command packet to the drone."""
+        if self.transport is None:
+            return False
+        cmd = pkt.get_buffer()
+        self.transport.sendto(cmd, self.tello_addr)
+        log.debug("send_packet: %s", HexString(cmd))
+        rec = self.recorder
+        if rec is not None:
+            rec.write(recorder.CONTROL_OUT, cmd)
+        return True
+
+    def flight_data(self, maxsize=1):
+        """
+        Async iterator over FlightData as it arrives. When the consumer falls more
+        than maxsize behind, the oldest items are dropped.
+        """
+        return self.__iterate(self.EVENT_FLIGHT_DATA, maxsize)
+
+    def video_data(self, maxsize=256):
+        """
+        Async iterator over the raw H.264 stream, one packet payload at a time.
+        Starts the video stream on the drone.
+        """
+        self.start_video()
+        return self.__iterate(self.EVENT_VIDEO_FRAME, maxsize)
+
+    async def __iterate(self, signal, maxsize):
+        queue = asyncio.Queue(maxsize)
+
+        def handler(event, sender, data, **args):
+            self.__put_latest(queue, data)
+
+        self.queues.append(queue)
+        self.subscribe(signal, handler)
+        try:
+            while self.state != self.STATE_QUIT:
+                data = await queue.get()
+                if data is None:
+                    break
+                yield data
+        finally:
+            self.unsubscribe(signal, handler)
+            self.queues.remove(queue)
+
+    @staticmethod
+    def __put_latest(queue, data):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(data)
+
+    def __handle_event(self, event, sender, data, **args):
+        if event is self.EVENT_CONNECTED:
+            self.connected_event.set()
+        elif event is self.EVENT_DISCONNECTED:
+            self.connected_event.clear()
+
+    def __recv(self, data):
+        self.last_recv = time.monotonic()
+        self.handle_packet(data)
+
+    def __video_recv(self, data):
+        self.last_video_recv = time.monotonic()
+        if self.video_enabled:
+            self.handle_video_packet(data)
+
+    async def __watch_timeouts(self):
+        while self.state != self.STATE_QUIT:
+            await asyncio.sleep(0.1)
+            now = time.monotonic()
+            if self.RECV_TIMEOUT <= now - self.last_recv:
+                self.last_recv = now
+                self.handle_timeout()
+            if not self.video_enabled:
+                self.last_video_recv = now
+            elif self.VIDEO_TIMEOUT <= now - self.last_video_recv:
+                self.last_video_recv = now
+                self.handle_video_timeout()
+
+
+if __name__ == '__main__':
+    async def main():
+        drone = AsyncTello()
+        try:
+            await drone.connect(timeout=60.0)
+            async for flight_data in drone.flight_data():
+                print(flight_data)
+        finally:
+            await drone.quit()
+
+    asyncio.run(main())
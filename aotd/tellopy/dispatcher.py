@@ -1,38 +1,227 @@
+import collections
+import threading
+import time
+import traceback
+
 from aotd.tellopy import event
+from aotd.tellopy.scheduler import JitterStats
+
+# what a QueuedReceiver does with a new event when its queue is full
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
 
 
 class signal(object):
     All = event.Event('*')
 
 
-signals = {}
+class Dispatcher(object):
+    """
+    Signal registry owned by one sender, normally one Tello, so dispatch cost only
+    depends on that sender's subscribers.
+
+    Every signal maps to a precomputed tuple of its receivers with the signal.All
+    receivers appended. connect and disconnect rebuild the index under a lock and
+    swap it in with one assignment, so send reads it without locking and never sees
+    a half-updated registry, whichever threads subscribe or unsubscribe meanwhile.
+    """
+
+    def __init__(self):
+        self.signals = {}
+        self.index = {}
+        self.lock = threading.Lock()
+
+    def connect(self, receiver, sig=signal.All):
+        with self.lock:
+            self.signals[sig] = self.signals.get(sig, ()) + (receiver,)
+            self.__rebuild()
+
+    def connect_queued(self, receiver, sig=signal.All, maxsize=64, policy=DROP_OLDEST, loop=None):
+        """
+        Connect receiver behind a bounded queue so it runs on its own worker thread,
+        or on the asyncio loop if one is given, instead of on the sending thread.
+        Returns the QueuedReceiver, which keeps the lag and drop counts.
+        """
+        queued = QueuedReceiver(receiver, maxsize, policy, loop)
+        self.connect(queued, sig)
+        return queued
+
+    def disconnect(self, receiver, sig=signal.All):
+        removed = []
+        with self.lock:
+            for key in (self.signals if sig is signal.All else [sig]):
+                if key in self.signals:
+                    keep = tuple(r for r in self.signals[key] if not self.__matches(r, receiver))
+                    removed.extend(r for r in self.signals[key] if r not in keep)
+                    self.signals[key] = keep
+            self.__rebuild()
+        for r in removed:
+            if isinstance(r, QueuedReceiver):
+                r.close()
+
+    def queued_receivers(self):
+        """Every QueuedReceiver connected, for reporting their lag."""
+        receivers = []
+        for rs in self.index.values():
+            receivers.extend(r for r in rs if isinstance(r, QueuedReceiver) and r not in receivers)
+        return receivers
+
+    def has_receivers(self, sig):
+        """True if send(sig) would reach anyone. Lets senders skip building the event data."""
+        index = self.index
+        return bool(index.get(sig, index.get(signal.All)))
+
+    def send(self, sig, **named):
+        index = self.index
+        for receiver in index.get(sig, index.get(signal.All, ())):
+            receiver(event=sig, **named)
+
+    @staticmethod
+    def __matches(r, receiver):
+        return r == receiver or (isinstance(r, QueuedReceiver) and r.handler == receiver)
+
+    def __rebuild(self):
+        everyone = self.signals.get(signal.All, ())
+        index = dict((sig, receivers + everyone) for sig, receivers in self.signals.items())
+        index[signal.All] = everyone
+        self.index = index
+
+
+class QueuedReceiver(object):
+    """
+    Receiver that hands events over to a bounded queue and returns at once, so a
+    slow handler cannot hold up the thread reading the sockets. The handler runs on
+    a worker thread, or on loop when given. When the queue is full the policy
+    decides: DROP_OLDEST or DROP_NEWEST discards an event and counts it in dropped,
+    BLOCK makes the sender wait (never use BLOCK with the loop that sends the events).
+    lag keeps the time from send to the handler call in seconds.
+    """
+
+    def __init__(self, handler, maxsize=64, policy=DROP_OLDEST, loop=None):
+        if policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError('unknown overflow policy %s' % policy)
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.loop = loop
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.lag = JitterStats()
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.closed = False
+        self.thread = None
+        if loop is None:
+            self.thread = threading.Thread(target=self.__run, name='QueuedReceiver', daemon=True)
+            self.thread.start()
+
+    def __call__(self, event, **named):
+        with self.cond:
+            if len(self.queue) >= self.maxsize:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                elif self.policy == DROP_OLDEST:
+                    self.queue.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self.queue) >= self.maxsize and not self.closed:
+                        self.cond.wait()
+            if self.closed:
+                return
+            self.queue.append((time.monotonic(), event, named))
+            self.max_depth = max(self.max_depth, len(self.queue))
+            self.cond.notify_all()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.__drain)
+
+    def depth(self):
+        return len(self.queue)
 
+    def close(self):
+        """Stop delivering. Events still queued are discarded."""
+        with self.cond:
+            self.closed = True
+            self.queue.clear()
+            self.cond.notify_all()
 
-def connect(receiver, sig=signal.All):
-    if sig in signals:
-        receivers = signals[sig]
-    else:
-        receivers = signals[sig] = []
-    receivers.append(receiver)
+    def __run(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                item = self.queue.popleft()
+                self.cond.notify_all()
+            self.__deliver(item)
 
+    def __drain(self):
+        while True:
+            with self.cond:
+                if not self.queue:
+                    return
+                item = self.queue.popleft()
+                self.cond.notify_all()
+            self.__deliver(item)
 
-def disconnect(receiver, sig=signal.All):
-    if sig is signal.All:
-        for sig in signals:
-            if receiver in signals[sig]:
-                signals[sig].remove(receiver)
-    elif sig in signals:
-        if receiver in signals[sig]:
-            signals[sig].remove(receiver)
+    def __deliver(self, item):
+        sent, event, named = item
+        self.lag.add(time.monotonic() - sent)
+        try:
+            self.handler(event=event, **named)
+        except Exception:
+            self.errors += 1
+            traceback.print_exc()
+        self.delivered += 1
 
+    def __str__(self):
+        return ('%s: depth=%d max=%d delivered=%d dropped=%d lag mean=%.3fms max=%.3fms' %
+                (getattr(self.handler, '__name__', self.handler), len(self.queue), self.max_depth,
+                 self.delivered, self.dropped, self.lag.mean * 1000, self.lag.max * 1000))
 
-def send(sig, **named):
-    if sig in signals:
-        receivers = signals[sig] + signals[signal.All]
-    else:
-        receivers = signals[signal.All]
-    for receiver in receivers:
-        receiver(event=sig, **named)
+
+class Batch(object):
+    """
+    Receiver that queues events instead of handling them one by one. flush() hands handler
+    the list of (event, named arguments) pairs collected since the last flush, if any.
+    Tello.subscribe_batch flushes on every stick tick; a Batch connected by hand is
+    flushed by whoever connected it.
+    """
+
+    def __init__(self, handler, maxlen=None):
+        self.handler = handler
+        self.maxlen = maxlen
+        self.events = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, event, **named):
+        with self.lock:
+            self.events.append((event, named))
+            if self.maxlen is not None and self.maxlen < len(self.events):
+                # keep the newest events when the flushing side falls behind
+                del self.events[0]
+                self.dropped += 1
+
+    def flush(self):
+        with self.lock:
+            events, self.events = self.events, []
+        if events:
+            self.handler(events)
+        return len(events)
+
+
+# process wide dispatcher for code that is not tied to a drone
+default = Dispatcher()
+connect = default.connect
+disconnect = default.disconnect
+connect_queued = default.connect_queued
+has_receivers = default.has_receivers
+send = default.send
 
 
 if __name__ == '__main__':
@@ -48,8 +237,12 @@ if __name__ == '__main__':
 
     test_signal0 = event.Event('test signal0')
     test_signal1 = event.Event('test signal1')
+    assert not has_receivers(test_signal0)
+    send(test_signal0, sender=None)
+
     connect(handler0, signal.All)
     connect(handler1, test_signal0)
+    assert has_receivers(test_signal0) and has_receivers(test_signal1)
 
     recvs = []
     send(test_signal0, sender=None)
@@ -64,3 +257,64 @@ if __name__ == '__main__':
     recvs = []
     send(test_signal0, sender=None, arg0=0, arg1=1, arg2=2)
     assert len(recvs) == 1 and 0 in recvs
+
+    disconnect(handler0)
+    assert not has_receivers(test_signal0) and not has_receivers(test_signal1)
+
+    # dispatchers are independent of each other
+    other = Dispatcher()
+    other.connect(handler1, test_signal0)
+    recvs = []
+    send(test_signal0, sender=None)
+    other.send(test_signal0, sender=None)
+    assert recvs == [1]
+
+    batches = []
+    batch = Batch(batches.append, maxlen=2)
+    other.connect(batch, test_signal1)
+    for i in range(3):
+        other.send(test_signal1, sender=None, data=i)
+    assert batch.flush() == 2 and batch.dropped == 1
+    assert [named['data'] for _, named in batches[0]] == [1, 2]
+    assert batch.flush() == 0 and len(batches) == 1
+
+    # a slow queued receiver does not hold up send
+    slow = []
+    queued = other.connect_queued(lambda event, sender, data: (time.sleep(0.01), slow.append(data)),
+                                  test_signal0, maxsize=4, policy=DROP_OLDEST)
+    start = time.monotonic()
+    for i in range(20):
+        other.send(test_signal0, sender=None, data=i)
+    assert time.monotonic() - start < 0.01
+    time.sleep(0.2)
+    print(queued)
+    assert slow[-1] == 19 and queued.dropped + queued.delivered == 20
+    assert other.queued_receivers() == [queued]
+    other.disconnect(queued.handler, test_signal0)
+    assert queued.closed and not other.queued_receivers()
+
+    # Tello.subscribe_queued hands events to a worker on the drone's own dispatcher
+    from aotd.tellopy.tello import Tello
+    drone = Tello(start_threads=False)
+    flight_data = []
+    queued = drone.subscribe_queued(drone.EVENT_FLIGHT_DATA, lambda event, sender, data: flight_data.append(data),
+                                    policy=BLOCK)
+    assert drone.dispatcher.queued_receivers() == [queued] and not default.queued_receivers()
+    for i in range(5):
+        drone.dispatcher.send(drone.EVENT_FLIGHT_DATA, sender=drone, data=i)
+    time.sleep(0.1)
+    assert flight_data == [0, 1, 2, 3, 4] and queued.delivered == 5
+    drone.unsubscribe(drone.EVENT_FLIGHT_DATA, queued.handler)
+    assert queued.closed and not drone.dispatcher.queued_receivers()
+
+    # Tello.subscribe_batch is flushed by the stick tick
+    batches = []
+    batch = drone.subscribe_batch(drone.EVENT_FLIGHT_DATA, batches.append)
+    for i in range(3):
+        drone.dispatcher.send(drone.EVENT_FLIGHT_DATA, sender=drone, data=i)
+    drone.handle_stick_tick()
+    assert [named['data'] for _, named in batches[0]] == [0, 1, 2]
+    drone.handle_stick_tick()
+    assert len(batches) == 1
+    drone.unsubscribe(drone.EVENT_FLIGHT_DATA, batch)
+    assert not drone.batches and not drone.dispatcher.has_receivers(drone.EVENT_FLIGHT_DATA)
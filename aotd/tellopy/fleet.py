@@ -0,0 +1,165 @@
+import selectors
+import socket
+import threading
+import time
+
+from . import scheduler
+from .protocol import *
+from .tello import Tello, log
+
+
+class Fleet(object):
+    """
+    Drives several drones from one process with a single thread. All control and
+    video sockets share one selector and every drone's stick commands and timeouts
+    run off one timer wheel, so the thread count stays the same as drones are added.
+
+    Every Tello answers on 192.168.10.1, so each drone normally sits behind its own
+    wifi interface: pass that interface's address as local_host, or its name as
+    interface to bind the sockets to the device itself (Linux only).
+    """
+    BASE_PORT = 9000
+    BASE_VIDEO_PORT = 6038
+    RECV_TIMEOUT = 2.0
+    VIDEO_TIMEOUT = 1.0
+
+    def __init__(self, stick_rate=50.0, tick=0.002):
+        self.stick_rate = stick_rate
+        self.selector = selectors.DefaultSelector()
+        self.wheel = scheduler.TimerWheel(tick)
+        self.drones = []
+        self.sockets = []
+        self.timers = {}
+        self.last_recv = {}
+        self.last_video_recv = {}
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def add(self, tello_addr=('192.168.10.1', 8889), port=None, video_port=None, local_host='', interface=None):
+        """
+        Add a drone and open its sockets. Ports default to BASE_PORT + n and
+        BASE_VIDEO_PORT + n for the n-th drone so drones never collide.
+        """
+        index = len(self.drones)
+        port = self.BASE_PORT + index if port is None else port
+        video_port = self.BASE_VIDEO_PORT + index if video_port is None else video_port
+        drone = Tello(port, self.stick_rate, start_threads=False,
+                      tello_addr=tello_addr, video_port=video_port, local_host=local_host)
+        drone.sock = self.__open_socket(local_host, port, interface)
+        video_sock = self.__open_socket(local_host, video_port, interface)
+        video_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 512 * 1024)
+
+        now = time.monotonic()
+        with self.lock:
+            self.drones.append(drone)
+            self.sockets.extend([drone.sock, video_sock])
+            self.last_recv[drone] = self.last_video_recv[drone] = now
+            self.selector.register(drone.sock, selectors.EVENT_READ, (drone, False))
+            self.selector.register(video_sock, selectors.EVENT_READ, (drone, True))
+            stick_timer = self.wheel.add(drone.handle_stick_tick, 1.0 / self.stick_rate)
+            # the wheel sends the sticks, so set_stick_rate() and the jitter stats go to its timer
+            drone.stick_scheduler = stick_timer
+            self.timers[drone] = [
+                stick_timer,
+                self.wheel.add(lambda: self.__check_timeouts(drone), 0.1),
+            ]
+        log.info('fleet: drone %d at %s:%d, ports %d/%d' % (index, tello_addr[0], tello_addr[1], port, video_port))
+        return drone
+
+    def start(self):
+        """Start the fleet thread. Drones added later are picked up as well."""
+        self.running = True
+        self.thread = threading.Thread(target=self.__run, name='Fleet', daemon=True)
+        self.thread.start()
+
+    def connect(self):
+        for drone in self.drones:
+            drone.connect()
+
+    def wait_for_connection(self, timeout=None):
+        for drone in self.drones:
+            drone.wait_for_connection(timeout)
+
+    def quit(self):
+        """Quit disconnects every drone, stops the fleet thread and closes the sockets."""
+        for drone in self.drones:
+            drone.quit()
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        for sock in self.sockets:
+            self.selector.unregister(sock)
+            sock.close()
+        self.sockets = []
+
+    def stick_stats(self, drone):
+        return self.timers[drone][0].stats
+
+    @staticmethod
+    def __open_socket(local_host, port, interface):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if interface is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, interface.encode())
+        sock.bind((local_host, port))
+        sock.setblocking(False)
+        return sock
+
+    def __run(self):
+        while self.running:
+            timeout = max(0.0, self.wheel.next_tick() - time.monotonic())
+            with self.lock:
+                events = self.selector.select(timeout)
+            for key, mask in events:
+                drone, video = key.data
+                self.__drain(key.fileobj, drone, video)
+            with self.lock:
+                self.wheel.advance()
+        log.info('exit from the fleet thread.')
+
+    def __drain(self, sock, drone, video):
+        while True:
+            try:
+                data, server = sock.recvfrom(drone.udpsize)
+            except (BlockingIOError, InterruptedError):
+                return
+            except socket.error as ex:
+                log.error('fleet recv: %s' % str(ex))
+                return
+            try:
+                if not video:
+                    self.last_recv[drone] = time.monotonic()
+                    drone.handle_packet(data)
+                elif drone.video_enabled:
+                    self.last_video_recv[drone] = time.monotonic()
+                    drone.handle_video_packet(data)
+            except Exception as ex:
+                log.error('fleet recv: %s' % str(ex))
+                show_exception(ex)
+
+    def __check_timeouts(self, drone):
+        if drone.state == drone.STATE_QUIT:
+            for timer in self.timers[drone]:
+                timer.cancel()
+            return
+        now = time.monotonic()
+        if self.RECV_TIMEOUT <= now - self.last_recv[drone]:
+            self.last_recv[drone] = now
+            drone.handle_timeout()
+        if not drone.video_enabled:
+            self.last_video_recv[drone] = now
+        elif self.VIDEO_TIMEOUT <= now - self.last_video_recv[drone]:
+            self.last_video_recv[drone] = now
+            drone.handle_video_timeout()
+
+
+if __name__ == '__main__':
+    fleet = Fleet()
+    drone = fleet.add()
+    fleet.start()
+    try:
+        fleet.connect()
+        fleet.wait_for_connection(60.0)
+        print('connected: %s' % drone.state)
+    finally:
+        fleet.quit()
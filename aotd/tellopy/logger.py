@@ -1,5 +1,9 @@
+import atexit
+import collections
 import datetime
+import logging
 import threading
+import time
 
 LOG_ERROR = 0
 LOG_WARN = 1
@@ -7,45 +11,107 @@ LOG_INFO = 2
 LOG_DEBUG = 3
 LOG_ALL = 99
 
+LEVEL_NAMES = {LOG_ERROR: 'Error', LOG_WARN: 'Warn', LOG_INFO: 'Info', LOG_DEBUG: 'Debug'}
+STDLIB_LEVELS = {LOG_ERROR: logging.ERROR, LOG_WARN: logging.WARNING, LOG_INFO: logging.INFO,
+                 LOG_DEBUG: logging.DEBUG}
+
 
 class Logger(object): #Object inheritence for child 'RospyLogger' (Jordy)
+    """
+    Messages take their arguments separately, log.debug('recv: %s', data), and are
+    only formatted when the level is enabled. Enabled records are handed to a
+    background writer thread through a bounded queue, so the caller never waits on
+    the console; when the queue is full the oldest records are dropped and counted.
+    After use_logging() records go to a stdlib logging.Logger instead of print.
+    """
+    QUEUE_SIZE = 4096
+
     def __init__(self, header=''):
         self.log_level = LOG_INFO
         self.header_string = header
         self.lock = threading.Lock()
+        self.records = collections.deque(maxlen=self.QUEUE_SIZE)
+        self.cond = threading.Condition(self.lock)
+        self.written = 0
+        self.queued = 0
+        self.dropped = 0
+        self.stdlib_logger = None
+        self.writer = None
 
-    def header(self):
-        now = datetime.datetime.now()
+    def header(self, timestamp=None):
+        now = datetime.datetime.fromtimestamp(time.time() if timestamp is None else timestamp)
         ts = ("%02d:%02d:%02d.%03d" % (now.hour, now.minute, now.second, now.microsecond/1000))
         return "%s: %s" % (self.header_string, ts)
 
     def set_level(self, level):
         self.log_level = level
 
+    def is_enabled(self, level):
+        return level <= self.log_level
+
+    def use_logging(self, name=None):
+        """Send records to logging.getLogger(name), tellopy.<header> by default, instead of printing them."""
+        self.stdlib_logger = logging.getLogger(name or 'tellopy.%s' % self.header_string)
+
     def output(self, msg):
-        self.lock.acquire()
         print(msg)
-        self.lock.release()
 
-    def error(self, str):
+    def flush(self, timeout=1.0):
+        """Wait until the writer thread has written every queued record."""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.written + self.dropped < self.queued and time.monotonic() < deadline:
+                self.cond.wait(deadline - time.monotonic())
+
+    def error(self, str, *args):
         if self.log_level < LOG_ERROR:
             return
-        self.output("%s: Error: %s" % (self.header(), str))
+        self.__submit(LOG_ERROR, str, args)
 
-    def warn(self, str):
+    def warn(self, str, *args):
         if self.log_level < LOG_WARN:
             return
-        self.output("%s:  Warn: %s" % (self.header(), str))
+        self.__submit(LOG_WARN, str, args)
 
-    def info(self, str):
+    def info(self, str, *args):
         if self.log_level < LOG_INFO:
             return
-        self.output("%s:  Info: %s" % (self.header(), str))
+        self.__submit(LOG_INFO, str, args)
 
-    def debug(self, str):
+    def debug(self, str, *args):
         if self.log_level < LOG_DEBUG:
             return
-        self.output("%s: Debug: %s" % (self.header(), str))
+        self.__submit(LOG_DEBUG, str, args)
+
+    def __submit(self, level, msg, args):
+        # format here, arguments such as packet buffers may be reused after the call
+        if args:
+            msg = msg % args
+        with self.cond:
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append((time.time(), level, msg))
+            self.queued += 1
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.__write, name='Logger', daemon=True)
+                self.writer.start()
+                atexit.register(self.flush)
+            self.cond.notify_all()
+
+    def __write(self):
+        while True:
+            with self.cond:
+                while not self.records:
+                    self.cond.wait()
+                timestamp, level, msg = self.records.popleft()
+            if self.stdlib_logger is not None:
+                self.stdlib_logger.log(STDLIB_LEVELS[level], msg)
+            else:
+                self.output("%s: %5s: %s" % (self.header(timestamp), LEVEL_NAMES[level], msg))
+            with self.cond:
+                self.written += 1
+                self.cond.notify_all()
+
 
 if __name__ == '__main__':
     log = Logger('test')
@@ -55,3 +121,11 @@ if __name__ == '__main__':
     log.debug('This should ** NOT **  be displayed')
     log.set_level(LOG_ALL)
     log.debug('This is a debug message')
+    log.debug('This is a %s message with %d args', 'formatted', 2)
+    log.flush()
+    assert log.written == 5 and log.dropped == 0
+
+    logging.basicConfig(level=logging.DEBUG, format='%(name)s %(levelname)s %(message)s')
+    log.use_logging()
+    log.info('This goes through the logging module')
+    log.flush()
@@ -1,4 +1,6 @@
 import datetime
+import struct
+import time
 from io import BytesIO
 
 from . import crc
@@ -56,6 +58,14 @@ ATT_LIMIT_MSG = 0x1059
 
 EMERGENCY_CMD = 'emergency'
 
+# Reasons verify_packet() gives for rejecting a received frame
+PACKET_BAD_START = 'start'
+PACKET_TOO_SHORT = 'short'
+PACKET_BAD_SIZE = 'size'
+PACKET_BAD_CRC8 = 'crc8'
+PACKET_BAD_CRC16 = 'crc16'
+PACKET_ERRORS = (PACKET_BAD_START, PACKET_TOO_SHORT, PACKET_BAD_SIZE, PACKET_BAD_CRC8, PACKET_BAD_CRC16)
+
 # Flip commands taken from Go version of code
 # FlipFront flips forward.
 FlipFront = 0
@@ -97,8 +107,7 @@ class Packet(object):
     def fixup(self, seq_num=0):
         buf = self.get_buffer()
         if buf[0] == START_OF_PACKET:
-            buf[1], buf[2] = le16(len(buf) + 2)
-            buf[1] = (buf[1] << 3)
+            buf[1], buf[2] = le16((len(buf) + 2) << 3)
             buf[3] = crc.crc8(buf[0:3])
             buf[7], buf[8] = le16(seq_num)
             self.add_int16(crc.crc16(buf))
@@ -134,87 +143,143 @@ class Packet(object):
         return datetime.datetime(now.year, now.month, now.day, hour, min, sec, millisec)
 
 
+class StickCommand(object):
+    """
+    Reusable STICK_CMD packet. Only the axis and time fields change between sends,
+    so they are patched in place and the crc16 carries on from the fixed header.
+    """
+    # axes packed into 6 bytes (uint32 + uint16), then hour, min, sec, msec low, msec high
+    FIELDS = struct.Struct('<IH5H')
+    FIELDS_OFFSET = 9
+
+    def __init__(self):
+        pkt = Packet(STICK_CMD, 0x60, bytes(self.FIELDS.size))
+        pkt.fixup()
+        self.buf = pkt.get_buffer()
+        self.view = memoryview(self.buf)
+        self.crc_offset = self.FIELDS_OFFSET + self.FIELDS.size
+        self.header_crc = crc.crc16(self.view[:self.FIELDS_OFFSET])
+        self.utc_offset = time.localtime().tm_gmtoff
+
+    def update(self, right_x, right_y, left_y, left_x, fast_mode):
+        axis1 = int(1024 + 660.0 * right_x) & 0x7ff
+        axis2 = int(1024 + 660.0 * right_y) & 0x7ff
+        axis3 = int(1024 + 660.0 * left_y) & 0x7ff
+        axis4 = int(1024 + 660.0 * left_x) & 0x7ff
+        axis5 = int(fast_mode) & 0x01
+        '''
+        11 bits (-1024 ~ +1023) x 4 axis = 44 bits
+        fast_mode takes 1 bit
+        44 bits will be packed in to 6 bytes (48 bits)
+
+                    axis4      axis3      axis2      axis1
+             |          |          |          |          |
+                 4         3         2         1         0
+        98765432109876543210987654321098765432109876543210
+         |       |       |       |       |       |       |
+             byte5   byte4   byte3   byte2   byte1   byte0
+        '''
+        packed = axis1 | (axis2 << 11) | (axis3 << 22) | (axis4 << 33) | (axis5 << 44)
+
+        now = time.time() + self.utc_offset
+        seconds = int(now) % 86400
+        millisec = int((now % 1) * 1000)
+        self.FIELDS.pack_into(self.buf, self.FIELDS_OFFSET,
+                              packed & 0xffffffff, packed >> 32,
+                              seconds // 3600, (seconds // 60) % 60, seconds % 60,
+                              millisec & 0xff, millisec >> 8)
+        value = crc.crc16(self.view[self.FIELDS_OFFSET:self.crc_offset], self.header_crc)
+        self.buf[self.crc_offset], self.buf[self.crc_offset + 1] = le16(value)
+        return self
+
+    def get_buffer(self):
+        return self.buf
+
+
+def verify_packet(data):
+    """
+    Check the framing of a received packet without copying it.
+    Returns None for a well formed packet, otherwise one of the PACKET_* reasons.
+    """
+    if data[0] != START_OF_PACKET:
+        return PACKET_BAD_START
+    if len(data) < 11:
+        return PACKET_TOO_SHORT
+    if uint16(data[1], data[2]) >> 3 != len(data):
+        return PACKET_BAD_SIZE
+    # a crc run over its own little endian trailer always leaves zero behind
+    table = crc.crc8table
+    if table[table[table[table[crc.CRC8_INIT ^ data[0]] ^ data[1]] ^ data[2]] ^ data[3]] != 0:
+        return PACKET_BAD_CRC8
+    if crc.crc16(data) != 0:
+        return PACKET_BAD_CRC16
+    return None
+
+
+def _flag(field, shift):
+    return property(lambda self: (getattr(self, field) >> shift) & 0x1)
+
+
 class FlightData(object):
-    def __init__(self, data):
-        self.battery_low = 0
-        self.battery_lower = 0
-        self.battery_percentage = 0
-        self.battery_state = 0
-        self.camera_state = 0
-        self.down_visual_state = 0
-        self.drone_battery_left = 0
-        self.drone_fly_time_left = 0
-        self.drone_hover = 0
-        self.em_open = 0
-        self.em_sky = 0
-        self.em_ground = 0
-        self.east_speed = 0
-        self.electrical_machinery_state = 0
-        self.factory_mode = 0
-        self.fly_mode = 0
-        self.fly_speed = 0
-        self.fly_time = 0
-        self.front_in = 0
-        self.front_lsc = 0
-        self.front_out = 0
-        self.gravity_state = 0
-        self.ground_speed = 0
-        self.height = 0
-        self.imu_calibration_state = 0
-        self.imu_state = 0
-        self.light_strength = 0
-        self.north_speed = 0
-        self.outage_recording = 0
-        self.power_state = 0
-        self.pressure_state = 0
-        self.smart_video_exit_mode = 0
-        self.temperature_height = 0
-        self.throw_fly_timer = 0
-        self.wifi_disturb = 0
+    """Payload of FLIGHT_MSG."""
+    LAYOUT = struct.Struct('<5h3B2h7B')
+    FIELDS = ('height', 'north_speed', 'east_speed', 'ground_speed', 'fly_time',
+              'status0', 'imu_calibration_state', 'battery_percentage', 'drone_battery_left', 'drone_fly_time_left',
+              'status1', 'fly_mode', 'throw_fly_timer', 'camera_state', 'electrical_machinery_state',
+              'status2', 'status3')
+    __slots__ = FIELDS + ('wifi_strength',)
+    EMPTY = (0,) * len(FIELDS)
+
+    # status bit table: name = _flag(status byte, bit)
+    imu_state = _flag('status0', 0)
+    pressure_state = _flag('status0', 1)
+    down_visual_state = _flag('status0', 2)
+    power_state = _flag('status0', 3)
+    battery_state = _flag('status0', 4)
+    gravity_state = _flag('status0', 5)
+    wind_state = _flag('status0', 7)
+    em_sky = _flag('status1', 0)
+    em_ground = _flag('status1', 1)
+    em_open = _flag('status1', 2)
+    drone_hover = _flag('status1', 3)
+    outage_recording = _flag('status1', 4)
+    battery_low = _flag('status1', 5)
+    battery_lower = _flag('status1', 6)
+    factory_mode = _flag('status1', 7)
+    front_in = _flag('status2', 0)
+    front_out = _flag('status2', 1)
+    front_lsc = _flag('status2', 2)
+    temperature_height = _flag('status3', 0)
+
+    # not part of the payload, kept for the fields shown by older clients
+    fly_speed = 0
+    light_strength = 0
+    smart_video_exit_mode = 0
+    wifi_disturb = 0
+
+    def __init__(self, data=b''):
         self.wifi_strength = 0
-        self.wind_state = 0
-
-        if len(data) < 24:
-            return
-
-        self.height = int16(data[0], data[1])
-        self.north_speed = int16(data[2], data[3])
-        self.east_speed = int16(data[4], data[5])
-        self.ground_speed = int16(data[6], data[7])
-        self.fly_time = int16(data[8], data[9])
-
-        self.imu_state = ((data[10] >> 0) & 0x1)
-        self.pressure_state = ((data[10] >> 1) & 0x1)
-        self.down_visual_state = ((data[10] >> 2) & 0x1)
-        self.power_state = ((data[10] >> 3) & 0x1)
-        self.battery_state = ((data[10] >> 4) & 0x1)
-        self.gravity_state = ((data[10] >> 5) & 0x1)
-        self.wind_state = ((data[10] >> 7) & 0x1)
-
-        self.imu_calibration_state = data[11]
-        self.battery_percentage = data[12]
-        self.drone_battery_left = int16(data[13], data[14])
-        self.drone_fly_time_left = int16(data[15], data[16])
-
-        self.em_sky = ((data[17] >> 0) & 0x1)
-        self.em_ground = ((data[17] >> 1) & 0x1)
-        self.em_open = ((data[17] >> 2) & 0x1)
-        self.drone_hover = ((data[17] >> 3) & 0x1)
-        self.outage_recording = ((data[17] >> 4) & 0x1)
-        self.battery_low = ((data[17] >> 5) & 0x1)
-        self.battery_lower = ((data[17] >> 6) & 0x1)
-        self.factory_mode = ((data[17] >> 7) & 0x1)
-
-        self.fly_mode = data[18]
-        self.throw_fly_timer = data[19]
-        self.camera_state = data[20]
-        self.electrical_machinery_state = data[21]
-
-        self.front_in = ((data[22] >> 0) & 0x1)
-        self.front_out = ((data[22] >> 1) & 0x1)
-        self.front_lsc = ((data[22] >> 2) & 0x1)
-
-        self.temperature_height = ((data[23] >> 0) & 0x1)
+        self.update_from(data)
+
+    def update_from(self, data):
+        """Decode a FLIGHT_MSG payload into this instance. Payloads shorter than 24 bytes decode as all zero."""
+        if len(data) < self.LAYOUT.size:
+            values = self.EMPTY
+        else:
+            values = self.LAYOUT.unpack_from(data)
+        (self.height, self.north_speed, self.east_speed, self.ground_speed, self.fly_time,
+         self.status0, self.imu_calibration_state, self.battery_percentage, self.drone_battery_left,
+         self.drone_fly_time_left,
+         self.status1, self.fly_mode, self.throw_fly_timer, self.camera_state, self.electrical_machinery_state,
+         self.status2, self.status3) = values
+        return self
+
+    def copy(self):
+        """New instance with the same field values, without decoding the payload again."""
+        other = FlightData.__new__(FlightData)
+        for name in self.__slots__:
+            setattr(other, name, getattr(self, name))
+        return other
 
     def __str__(self):
         return (
@@ -285,16 +350,93 @@ class VideoData(object):
         return loss
 
 
+# bytes.translate tables that xor every byte with the table index
+XOR_TABLES = [bytes(b ^ key for b in range(256)) for key in range(256)]
+
+# log record id -> LogRecord subclass, see register_log_record
+LOG_RECORD_TYPES = {}
+
+
+def register_log_record(cls):
+    """
+    Class decorator declaring a LogRecord subclass as the decoder of its ID. Decoders
+    registered from outside tellopy are picked up by every LogData the next time their
+    id comes in.
+    """
+    LOG_RECORD_TYPES[cls.ID] = cls
+    return cls
+
+
+class LogRecord(object):
+    """One onboard log record type, its FIELDS unpacked from LAYOUT on first access."""
+    ID = None
+    NAME = 'record'
+    LAYOUT = struct.Struct('')
+    FIELDS = ()
+    SCALE = {}
+
+    def __init__(self, log=None, data=None):
+        self.log = log
+        self.count = 0
+        self.payload = None
+        self.values = None
+        if data is not None:
+            self.update(data)
+
+    def update(self, data, count=0):
+        self.payload = data
+        self.count = count
+        self.values = None
+        if self.log is not None:
+            self.log.debug('%s: length=%d %s', self.NAME, len(data), HexString(data))
+
+    def decode(self):
+        """Dict of every field, unpacked from the latest payload on first use."""
+        if self.values is None:
+            if self.payload is None:
+                values = dict.fromkeys(self.FIELDS, 0.0)
+            else:
+                values = dict(zip(self.FIELDS, self.LAYOUT.unpack_from(self.payload)))
+                for field, scale in self.SCALE.items():
+                    values[field] *= scale
+            self.values = values
+        return self.values
+
+    def __getattr__(self, name):
+        if name in type(self).FIELDS:
+            return self.decode()[name]
+        raise AttributeError(name)
+
+    def __str__(self):
+        values = self.decode()
+        return ' '.join('%s=%s' % (field, values[field]) for field in self.FIELDS)
+
+    def format_cvs(self):
+        values = self.decode()
+        return ','.join('%f' % values[field] for field in self.FIELDS)
+
+    def format_cvs_header(self):
+        return ','.join('%s.%s' % (self.NAME, field) for field in self.FIELDS)
+
+
 class LogData(object):
+    """Records of LOG_DATA_MSG, the latest of each id in records."""
     ID_NEW_MVO_FEEDBACK = 29
     ID_IMU_ATTI = 2048
-    unknowns = []
+    RECORD_HEADER = struct.Struct('<BhBHB')
+    unknowns = set()
+    short_records = set()
 
     def __init__(self, log, data=None):
         self.log = log
         self.count = 0
         self.mvo = LogNewMvoFeedback(log)
         self.imu = LogImuAtti(log)
+        # record id -> LogRecord holding its latest payload
+        self.records = {
+            self.ID_NEW_MVO_FEEDBACK: self.mvo,
+            self.ID_IMU_ATTI: self.imu,
+        }
         if data:
             self.update(data)
 
@@ -315,55 +457,55 @@ class LogData(object):
                 ',' + self.imu.format_cvs_header() +
                 "")
 
-    def update(self, data):
-        if isinstance(data, bytearray):
-            data = str(data)
+    def record(self, id):
+        """The latest record with id, or None if none arrived or nothing decodes that id."""
+        return self.records.get(id)
 
-        self.log.debug('LogData: data length=%d' % len(data))
+    def update(self, data):
+        self.log.debug('LogData: data length=%d', len(data))
         self.count += 1
+        view = memoryview(data)
+        end = len(data) - 2
         pos = 0
-        while (pos < len(data) - 2):
-            if (struct.unpack_from('B', data, pos + 0)[0] != 0x55):
-                raise Exception('LogData: corrupted data at pos=%d, data=%s'
-                                % (pos, byte_to_hexstring(data[pos:])))
-            length = struct.unpack_from('<h', data, pos + 1)[0]
-            checksum = data[pos + 3]
-            id = struct.unpack_from('<H', data, pos + 4)[0]
+        while pos < end:
+            if len(data) < pos + self.RECORD_HEADER.size:
+                break
+            (start, length, checksum, id, xorval) = self.RECORD_HEADER.unpack_from(view, pos)
+            if start != 0x55 or length < 12 or end < pos + length:
+                break
             # 4bytes data[6:9] is tick
             # last 2 bytes are CRC
             # length-12 is the byte length of payload
-            xorval = data[pos + 6]
-            if isinstance(data, str):
-                payload = bytearray([ord(x) ^ ord(xorval) for x in data[pos + 10:pos + 10 + length - 12]])
-            else:
-                payload = bytearray([x ^ xorval for x in data[pos + 10:pos + 10 + length - 12]])
-            if id == self.ID_NEW_MVO_FEEDBACK:
-                self.mvo.update(payload, self.count)
-            elif id == self.ID_IMU_ATTI:
-                self.imu.update(payload, self.count)
-            else:
-                if not id in self.unknowns:
-                    self.log.info('LogData: UNHANDLED LOG DATA: id=%5d, length=%4d' % (id, length - 12))
-                    self.unknowns.append(id)
+            record = self.records.get(id)
+            if record is None and id in LOG_RECORD_TYPES:
+                record = self.records[id] = LOG_RECORD_TYPES[id](self.log)
+            if record is not None and length - 12 < record.LAYOUT.size:
+                # the fields are unpacked lazily, a short payload would only fail in whoever reads them
+                if id not in self.short_records:
+                    self.log.warn('LogData: %s record too short: id=%5d, length=%4d, need %d',
+                                  record.NAME, id, length - 12, record.LAYOUT.size)
+                    self.short_records.add(id)
+            elif record is not None:
+                payload = view[pos + 10:pos + length - 2].tobytes().translate(XOR_TABLES[xorval])
+                record.update(payload, self.count)
+            elif id not in self.unknowns:
+                self.log.info('LogData: UNHANDLED LOG DATA: id=%5d, length=%4d', id, length - 12)
+                self.unknowns.add(id)
 
             pos += length
-        if pos != len(data) - 2:
+        if pos != end:
             raise Exception('LogData: corrupted data at pos=%d, data=%s'
                             % (pos, byte_to_hexstring(data[pos:])))
 
 
-class LogNewMvoFeedback(object):
-    def __init__(self, log=None, data=None):
-        self.log = log
-        self.count = 0
-        self.vel_x = 0.0
-        self.vel_y = 0.0
-        self.vel_z = 0.0
-        self.pos_x = 0.0
-        self.pos_y = 0.0
-        self.pos_z = 0.0
-        if (data != None):
-            self.update(data, self.count)
+@register_log_record
+class LogNewMvoFeedback(LogRecord):
+    ID = LogData.ID_NEW_MVO_FEEDBACK
+    NAME = 'mvo'
+    # velocity in cm/s at offset 2, position at offset 8
+    LAYOUT = struct.Struct('<2x3h3f')
+    FIELDS = ('vel_x', 'vel_y', 'vel_z', 'pos_x', 'pos_y', 'pos_z')
+    SCALE = {'vel_x': 0.01, 'vel_y': 0.01, 'vel_z': 0.01}
 
     def __str__(self):
         return (
@@ -371,48 +513,15 @@ class LogNewMvoFeedback(object):
                 (" POS: %5.2f %5.2f %5.2f" % (self.pos_x, self.pos_y, self.pos_z)) +
                 "")
 
-    def format_cvs(self):
-        return (
-                ("%f,%f,%f" % (self.vel_x, self.vel_y, self.vel_z)) +
-                (",%f,%f,%f" % (self.pos_x, self.pos_y, self.pos_z)) +
-                "")
 
-    def format_cvs_header(self):
-        return (
-                "mvo.vel_x,mvo.vel_y,mvo.vel_z" +
-                ",mvo.pos_x,mvo.pos_y,mvo.pos_z" +
-                "")
-
-    def update(self, data, count=0):
-        self.log.debug('LogNewMvoFeedback: length=%d %s' % (len(data), byte_to_hexstring(data)))
-        self.count = count
-        (self.vel_x, self.vel_y, self.vel_z) = struct.unpack_from('<hhh', data, 2)
-        self.vel_x /= 100.0
-        self.vel_y /= 100.0
-        self.vel_z /= 100.0
-        (self.pos_x, self.pos_y, self.pos_z) = struct.unpack_from('fff', data, 8)
-        self.log.debug('LogNewMvoFeedback: ' + str(self))
-
-
-class LogImuAtti(object):
-    def __init__(self, log=None, data=None):
-        self.log = log
-        self.count = 0
-        self.acc_x = 0.0
-        self.acc_y = 0.0
-        self.acc_z = 0.0
-        self.gyro_x = 0.0
-        self.gyro_y = 0.0
-        self.gyro_z = 0.0
-        self.q0 = 0.0
-        self.q1 = 0.0
-        self.q2 = 0.0
-        self.q3 = 0.0
-        self.vg_x = 0.0
-        self.vg_y = 0.0
-        self.vg_z = 0.0
-        if (data != None):
-            self.update(data)
+@register_log_record
+class LogImuAtti(LogRecord):
+    ID = LogData.ID_IMU_ATTI
+    NAME = 'imu'
+    # acceleration at offset 20, gyro at 32, quaternion at 48, velocity at 76
+    LAYOUT = struct.Struct('<20x3f3f4x4f12x3f')
+    FIELDS = ('acc_x', 'acc_y', 'acc_z', 'gyro_x', 'gyro_y', 'gyro_z',
+              'q0', 'q1', 'q2', 'q3', 'vg_x', 'vg_y', 'vg_z')
 
     def __str__(self):
         return (
@@ -422,27 +531,11 @@ class LogImuAtti(object):
                 (" VG: %5.2f %5.2f %5.2f" % (self.vg_x, self.vg_y, self.vg_z)) +
                 "")
 
-    def format_cvs(self):
-        return (
-                ("%f,%f,%f" % (self.acc_x, self.acc_y, self.acc_z)) +
-                (",%f,%f,%f" % (self.gyro_x, self.gyro_y, self.gyro_z)) +
-                (",%f,%f,%f,%f" % (self.q0, self.q1, self.q2, self.q3)) +
-                (",%f,%f,%f" % (self.vg_x, self.vg_y, self.vg_z)) +
-                "")
-
-    def format_cvs_header(self):
-        return (
-                "imu.acc_x,imu.acc_y,imu.acc_z" +
-                ",imu.gyro_x,imu.gyro_y,imu.gyro_z" +
-                ",imu.q0,imu.q1,imu.q2, self.q3" +
-                ",imu.vg_x,imu.vg_y,imu.vg_z" +
-                "")
 
-    def update(self, data, count=0):
-        self.log.debug('LogImuAtti: length=%d %s' % (len(data), byte_to_hexstring(data)))
-        self.count = count
-        (self.acc_x, self.acc_y, self.acc_z) = struct.unpack_from('fff', data, 20)
-        (self.gyro_x, self.gyro_y, self.gyro_z) = struct.unpack_from('fff', data, 32)
-        (self.q0, self.q1, self.q2, self.q3) = struct.unpack_from('ffff', data, 48)
-        (self.vg_x, self.vg_y, self.vg_z) = struct.unpack_from('fff', data, 76)
-        self.log.debug('LogImuAtti: ' + str(self))
+@register_log_record
+class LogUltrasonic(LogRecord):
+    ID = 16
+    NAME = 'usonic'
+    # height in cm, a valid flag and a sample counter, as in the DJI flight log
+    LAYOUT = struct.Struct('<hBB')
+    FIELDS = ('height', 'flag', 'cnt')
@@ -0,0 +1,230 @@
+import mmap
+import struct
+import threading
+import time
+
+# packet channels
+CONTROL_IN = 0
+CONTROL_OUT = 1
+VIDEO_IN = 2
+
+MAGIC = b'TELLOREC'
+VERSION = 1
+# magic, version, wall clock time of the recording start
+FILE_HEADER = struct.Struct('<8sHd')
+# b'CHNK', body length, record count, first and last record time, mask of the channels inside
+CHUNK_HEADER = struct.Struct('<4sIIddB')
+# time since the recording start, channel, payload length
+RECORD_HEADER = struct.Struct('<dBH')
+# chunk offset, first and last record time, channel mask
+INDEX_ENTRY = struct.Struct('<QddB')
+# index offset, magic
+TRAILER = struct.Struct('<Q8s')
+INDEX_MAGIC = b'TELLOIDX'
+
+
+class FlightRecorder(object):
+    """
+    Writes every packet to and from a drone into an append-only file. Records carry
+    the monotonic time since the recording started and are grouped into chunks of up
+    to CHUNK_SIZE bytes; each chunk header holds its time range and the channels in
+    it, so a reader can skip whole chunks. close() appends an index of the chunks;
+    if it never runs, FlightLog rebuilds the index by hopping over the chunk headers.
+    """
+    CHUNK_SIZE = 1024 * 1024
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, time.time()))
+        self.index = []
+        self.chunk = bytearray()
+        self.chunk_count = 0
+        self.chunk_first = 0.0
+        self.chunk_last = 0.0
+        self.chunk_mask = 0
+        self.packets = 0
+
+    def write(self, channel, data):
+        now = time.monotonic() - self.start
+        with self.lock:
+            if self.file is None:
+                return
+            if not self.chunk_count:
+                self.chunk_first = now
+            self.chunk += RECORD_HEADER.pack(now, channel, len(data))
+            self.chunk += data
+            self.chunk_count += 1
+            self.chunk_last = now
+            self.chunk_mask |= 1 << channel
+            self.packets += 1
+            if self.CHUNK_SIZE <= len(self.chunk) or self.FLUSH_INTERVAL <= now - self.chunk_first:
+                self.__write_chunk()
+
+    def close(self):
+        with self.lock:
+            if self.file is None:
+                return
+            self.__write_chunk()
+            offset = self.file.tell()
+            self.file.write(b'INDX' + struct.pack('<I', len(self.index)))
+            for entry in self.index:
+                self.file.write(INDEX_ENTRY.pack(*entry))
+            self.file.write(TRAILER.pack(offset, INDEX_MAGIC))
+            self.file.close()
+            self.file = None
+
+    def __write_chunk(self):
+        if not self.chunk_count:
+            return
+        offset = self.file.tell()
+        self.file.write(CHUNK_HEADER.pack(b'CHNK', len(self.chunk), self.chunk_count,
+                                          self.chunk_first, self.chunk_last, self.chunk_mask))
+        self.file.write(self.chunk)
+        self.file.flush()
+        self.index.append((offset, self.chunk_first, self.chunk_last, self.chunk_mask))
+        self.chunk = bytearray()
+        self.chunk_count = 0
+        self.chunk_mask = 0
+
+
+class ReplayStats(object):
+    """Packet counts and wall clock time of one FlightLog.replay()."""
+
+    def __init__(self):
+        self.control_packets = 0
+        self.video_packets = 0
+        self.video_frames = 0
+        self.elapsed = 0.0
+
+    def __str__(self):
+        elapsed = self.elapsed or 1e-9
+        return ('%d control + %d video packets in %.2fs: %.0f packets/s, %.1f frames/s' %
+                (self.control_packets, self.video_packets, self.elapsed,
+                 (self.control_packets + self.video_packets) / elapsed, self.video_frames / elapsed))
+
+
+class FlightLog(object):
+    """
+    Reads a FlightRecorder file through mmap. Only the chunks that overlap the
+    requested time range and hold a requested channel are touched.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.start_time = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a flight recording' % path)
+        self.index = self.__read_index()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def duration(self):
+        return self.index[-1][2] if self.index else 0.0
+
+    def packets(self, start=None, end=None, channels=None):
+        """
+        Yield (time, channel, data) for packets with start <= time < end on any of
+        channels, in recording order. Times are seconds since the recording started.
+        """
+        mask = 0xff if channels is None else sum(1 << channel for channel in channels)
+        for offset, first, last, chunk_mask in self.index:
+            if not chunk_mask & mask or (start is not None and last < start) or (end is not None and end <= first):
+                continue
+            _, length, count, _, _, _ = CHUNK_HEADER.unpack_from(self.map, offset)
+            pos = offset + CHUNK_HEADER.size
+            for _ in range(count):
+                t, channel, size = RECORD_HEADER.unpack_from(self.map, pos)
+                pos += RECORD_HEADER.size
+                if ((1 << channel) & mask and (start is None or start <= t) and (end is None or t < end)):
+                    yield t, channel, self.map[pos:pos + size]
+                pos += size
+
+    def replay(self, drone=None, start=None, end=None, speed=1.0, control=None, video=None):
+        """
+        Feed the received packets to drone.handle_packet and drone.handle_video_packet,
+        for example a Tello created with start_threads=False, or to the callables control
+        and video given in their place. With speed set the original timing is kept, scaled
+        by speed; with speed None packets are fed as fast as possible. Returns ReplayStats.
+        """
+        if drone is None and (control is None or video is None):
+            raise ValueError('replay needs a drone or both the control and video callables')
+        control = control or drone.handle_packet
+        video = video or drone.handle_video_packet
+        stats = ReplayStats()
+        t0 = None
+        wall0 = time.monotonic()
+        for t, channel, data in self.packets(start, end, (CONTROL_IN, VIDEO_IN)):
+            if speed:
+                if t0 is None:
+                    t0 = t
+                delay = (t - t0) / speed - (time.monotonic() - wall0)
+                if 0 < delay:
+                    time.sleep(delay)
+            if channel == CONTROL_IN:
+                control(data)
+                stats.control_packets += 1
+            else:
+                video(data)
+                stats.video_packets += 1
+                # the Tello does not always flag the last packet, every frame has a first one
+                if data[1] & 0x7f == 0:
+                    stats.video_frames += 1
+        stats.elapsed = time.monotonic() - wall0
+        return stats
+
+    def __read_index(self):
+        size = len(self.map)
+        if FILE_HEADER.size + TRAILER.size <= size:
+            offset, magic = TRAILER.unpack_from(self.map, size - TRAILER.size)
+            if magic == INDEX_MAGIC and self.map[offset:offset + 4] == b'INDX':
+                count = struct.unpack_from('<I', self.map, offset + 4)[0]
+                return [INDEX_ENTRY.unpack_from(self.map, offset + 8 + i * INDEX_ENTRY.size) for i in range(count)]
+        # no index, the recorder did not close: hop from chunk header to chunk header
+        index = []
+        offset = FILE_HEADER.size
+        while offset + CHUNK_HEADER.size <= size:
+            tag, length, count, first, last, mask = CHUNK_HEADER.unpack_from(self.map, offset)
+            if tag != b'CHNK' or size < offset + CHUNK_HEADER.size + length:
+                break
+            index.append((offset, first, last, mask))
+            offset += CHUNK_HEADER.size + length
+        return index
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    path = os.path.join(tempfile.mkdtemp(), 'flight.rec')
+    recorder = FlightRecorder(path)
+    recorder.CHUNK_SIZE = 4096
+    for i in range(1000):
+        recorder.write(VIDEO_IN if i % 4 else CONTROL_IN, bytes([i & 0xff]) * 100)
+    recorder.write(CONTROL_OUT, b'stick')
+    recorder.close()
+
+    flight_log = FlightLog(path)
+    packets = list(flight_log.packets())
+    assert len(packets) == 1001 and packets[-1][1:] == (CONTROL_OUT, b'stick')
+    assert len(list(flight_log.packets(channels=[CONTROL_IN]))) == 250
+    middle = packets[500][0]
+    assert all(middle <= t for t, _, _ in flight_log.packets(start=middle))
+    print('%d packets in %d chunks, %.3fs' % (len(packets), len(flight_log.index), flight_log.duration()))
+    flight_log.close()
+
+    # an unclosed recording is read by scanning the chunk headers
+    chunks = len(flight_log.index)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:flight_log.index[-1][0]])
+    flight_log = FlightLog(path)
+    assert len(flight_log.index) == chunks - 1 and len(list(flight_log.packets())) < 1001
+    flight_log.close()
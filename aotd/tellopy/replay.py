@@ -0,0 +1,130 @@
+import argparse
+import socket
+import threading
+import time
+
+from .recorder import FlightLog, ReplayStats
+from .tello import Tello
+
+
+class ReplayDrone(object):
+    """
+    Stands in for the drone on UDP. It answers the connection request like a Tello,
+    then sends the packets the drone sent in a recording: control packets back to the
+    client port and video packets to the video port named in conn_req. An unmodified
+    Tello pointed at addr cannot tell the difference.
+
+    speed 1.0 keeps the recorded timing, 2.0 plays twice as fast and None sends as
+    fast as possible; UDP has no flow control, so at full speed the client may drop
+    packets, use replay_direct for lossless runs. lead_in seconds pass between conn_ack and the first packet so
+    the client can start its video first.
+    """
+
+    def __init__(self, path, addr=('127.0.0.1', 8889), speed=1.0, start=None, end=None, lead_in=1.5):
+        self.flight_log = FlightLog(path)
+        self.speed = speed
+        self.start_time = start
+        self.end_time = end
+        self.lead_in = lead_in
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+        self.sock.bind(addr)
+        self.addr = self.sock.getsockname()
+        self.done = threading.Event()
+        self.thread = None
+        self.replay_stats = ReplayStats()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.__run, name='ReplayDrone', daemon=True)
+        self.thread.start()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def close(self):
+        self.sock.close()
+        self.flight_log.close()
+
+    def stats(self):
+        return str(self.replay_stats)
+
+    def __run(self):
+        client, video_addr = self.__accept()
+        time.sleep(self.lead_in)
+        self.replay_stats = self.flight_log.replay(start=self.start_time, end=self.end_time, speed=self.speed,
+                                                   control=lambda data: self.sock.sendto(data, client),
+                                                   video=lambda data: self.sock.sendto(data, video_addr))
+        self.done.set()
+
+    def __accept(self):
+        while True:
+            data, client = self.sock.recvfrom(2000)
+            if data.startswith(b'conn_req:') and 11 <= len(data):
+                video_port = data[9] | (data[10] << 8)
+                self.sock.sendto(b'conn_ack:' + data[9:11], client)
+                return client, (client[0], video_port)
+
+
+def replay_direct(path, drone, start=None, end=None):
+    """
+    Feed the received packets of a recording straight into drone.handle_packet and
+    drone.handle_video_packet on this thread, as fast as the drone takes them. Unlike
+    UDP nothing can be lost, so the throughput is repeatable. Returns the statistics.
+    """
+    flight_log = FlightLog(path)
+    try:
+        return str(flight_log.replay(drone, start, end, speed=None))
+    finally:
+        flight_log.close()
+
+
+def main(main_args):
+    if main_args.direct:
+        drone = Tello(port=main_args.port, start_threads=False, video_port=main_args.video_port,
+                      local_host='127.0.0.1')
+        drone.connect()
+        drone.start_video()
+        print('direct: %s' % replay_direct(main_args.path, drone, main_args.start, main_args.end))
+        drone.quit()
+        return
+
+    replay = ReplayDrone(main_args.path, speed=main_args.speed or None, start=main_args.start, end=main_args.end)
+    replay.start()
+    drone = Tello(port=main_args.port, tello_addr=replay.addr, video_port=main_args.video_port,
+                  local_host='127.0.0.1')
+    received = [0, 0]
+
+    def handler(event, sender, data, **args):
+        received[0 if event is drone.EVENT_FLIGHT_DATA else 1] += 1
+
+    try:
+        drone.subscribe(drone.EVENT_FLIGHT_DATA, handler)
+        drone.subscribe(drone.EVENT_VIDEO_DATA, handler)
+        drone.connect()
+        drone.wait_for_connection(10.0)
+        drone.start_video()
+        replay.wait()
+        time.sleep(0.5)
+        print('sent: %s' % replay.stats())
+        print('received: %d flight data, %d video packets (%d lost)' %
+              (received[0], received[1], replay.replay_stats.video_packets - received[1]))
+    finally:
+        drone.quit()
+        replay.close()
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a flight recording into a Tello over localhost UDP.')
+    parser.add_argument('path', type=str, help='recording written by Tello.start_recording()')
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help='playback speed, 1.0 is wall clock time and 0 is as fast as possible')
+    parser.add_argument('--start', type=float, default=None, help='seconds into the recording to start at')
+    parser.add_argument('--end', type=float, default=None, help='seconds into the recording to stop at')
+    parser.add_argument('--direct', action='store_true',
+                        help='call the Tello packet handlers directly instead of going through UDP, nothing is lost')
+    parser.add_argument('--port', type=int, default=9000, help='Tello control port')
+    parser.add_argument('--video_port', type=int, default=6038, help='Tello video port')
+
+    args = parser.parse_args()
+    main(args)
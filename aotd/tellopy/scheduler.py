@@ -0,0 +1,194 @@
+import asyncio
+import threading
+import time
+
+
+class JitterStats(object):
+    """Running statistics of how late each tick fired relative to its deadline, in seconds."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.missed = 0
+        self.mean = 0.0
+        self.max = 0.0
+        self.m2 = 0.0
+
+    def add(self, lateness):
+        self.count += 1
+        delta = lateness - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (lateness - self.mean)
+        if self.max < lateness:
+            self.max = lateness
+
+    def stddev(self):
+        if self.count < 2:
+            return 0.0
+        return (self.m2 / (self.count - 1)) ** 0.5
+
+    def __str__(self):
+        return ('ticks=%d missed=%d jitter mean=%.3fms std=%.3fms max=%.3fms' %
+                (self.count, self.missed, self.mean * 1000, self.stddev() * 1000, self.max * 1000))
+
+
+class RateScheduler(object):
+    """
+    Calls func at a fixed rate from its own thread. Deadlines advance on the monotonic
+    clock from the previous deadline, not from when func returned, so the rate does not
+    drift. Ticks missed by more than a whole period are skipped rather than sent in a burst.
+    """
+
+    def __init__(self, func, rate, name='RateScheduler'):
+        self.func = func
+        self.name = name
+        self.period = 1.0 / rate
+        self.stats = JitterStats()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def set_rate(self, rate):
+        self.period = 1.0 / rate
+
+    def get_rate(self):
+        return 1.0 / self.period
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.__run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    async def run_async(self):
+        """Run the same schedule as a task on the current event loop until stop() is called."""
+        self.stopped.clear()
+        deadline = time.monotonic()
+        while not self.stopped.is_set():
+            delay = deadline - time.monotonic()
+            if 0 < delay:
+                await asyncio.sleep(delay)
+                continue
+            deadline = self.__tick(deadline)
+
+    def __run(self):
+        deadline = time.monotonic()
+        while not self.stopped.is_set():
+            delay = deadline - time.monotonic()
+            if 0 < delay and self.stopped.wait(delay):
+                break
+            deadline = self.__tick(deadline)
+
+    def __tick(self, deadline):
+        self.stats.add(time.monotonic() - deadline)
+        self.func()
+
+        deadline += self.period
+        behind = time.monotonic() - deadline
+        if self.period < behind:
+            missed = int(behind / self.period)
+            self.stats.missed += missed
+            deadline += missed * self.period
+        return deadline
+
+
+class Timer(object):
+    """A periodic callback registered with a TimerWheel."""
+
+    def __init__(self, func, period, deadline):
+        self.func = func
+        self.period = period
+        self.deadline = deadline
+        self.stats = JitterStats()
+        self.cancelled = False
+
+    def set_rate(self, rate):
+        self.period = 1.0 / rate
+
+    def get_rate(self):
+        return 1.0 / self.period
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel(object):
+    """
+    Hashed timer wheel for many periodic callbacks driven from one loop. Timers are
+    filed by deadline into tick-sized slots, so advancing the wheel only touches the
+    slots that came due and the cost does not grow with the number of timers.
+    The owner calls advance() whenever time.monotonic() passes next_tick().
+    """
+
+    def __init__(self, tick=0.002, slots=512):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = int(time.monotonic() / tick)
+
+    def add(self, func, period):
+        """Call func every period seconds, starting now. Returns the Timer."""
+        timer = Timer(func, period, time.monotonic())
+        self.__insert(timer)
+        return timer
+
+    def next_tick(self):
+        return (self.current + 1) * self.tick
+
+    def advance(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        last = int(now / self.tick)
+        while self.current < last:
+            self.current += 1
+            slot = self.slots[self.current % len(self.slots)]
+            if not slot:
+                continue
+            due = [timer for timer in slot if timer.deadline < (self.current + 1) * self.tick]
+            if len(due) == len(slot):
+                slot.clear()
+            else:
+                # timers more than one revolution away stay for a later lap
+                slot[:] = [timer for timer in slot if timer not in due]
+            for timer in due:
+                if not timer.cancelled:
+                    self.__fire(timer, now)
+
+    def __fire(self, timer, now):
+        timer.stats.add(max(0.0, now - timer.deadline))
+        timer.func()
+
+        timer.deadline += timer.period
+        behind = now - timer.deadline
+        if timer.period < behind:
+            missed = int(behind / timer.period)
+            timer.stats.missed += missed
+            timer.deadline += missed * timer.period
+        self.__insert(timer)
+
+    def __insert(self, timer):
+        index = max(int(timer.deadline / self.tick), self.current + 1)
+        self.slots[index % len(self.slots)].append(timer)
+
+
+if __name__ == '__main__':
+    ticks = []
+    scheduler = RateScheduler(lambda: ticks.append(time.monotonic()), 100.0)
+    scheduler.start()
+    time.sleep(1.0)
+    scheduler.stop()
+    print('%d ticks in 1s: %s' % (len(ticks), scheduler.stats))
+    assert 95 <= len(ticks) <= 102
+
+    wheel = TimerWheel()
+    counts = [0, 0]
+    wheel.add(lambda: counts.__setitem__(0, counts[0] + 1), 0.02)
+    wheel.add(lambda: counts.__setitem__(1, counts[1] + 1), 0.05)
+    end = time.monotonic() + 1.0
+    while time.monotonic() < end:
+        time.sleep(max(0.0, wheel.next_tick() - time.monotonic()))
+        wheel.advance()
+    print('timer wheel ticks in 1s: %s' % counts)
+    assert 48 <= counts[0] <= 52 and 19 <= counts[1] <= 22
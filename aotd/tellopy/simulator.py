@@ -0,0 +1,297 @@
+import argparse
+import heapq
+import itertools
+import math
+import random
+import selectors
+import socket
+import struct
+import threading
+import time
+
+from . import scheduler
+from .protocol import *
+
+VIDEO_PAYLOAD = 1460
+
+
+def synthetic_h264(frames=30, width=320, height=240, gop=10):
+    """
+    A short H.264 clip as a list of Annex B access units. PyAV encodes a moving
+    gradient when it is installed; otherwise the units only have the NAL framing
+    (SPS and PPS with each IDR, then slices), enough for VideoStream but not a decoder.
+    """
+    try:
+        import av
+        import numpy as np
+    except ImportError:
+        units = []
+        for i in range(frames):
+            if i % gop == 0:
+                units.append(b'\x00\x00\x00\x01\x67' + bytes(8) + b'\x00\x00\x00\x01\x68' + bytes(4) +
+                             b'\x00\x00\x00\x01\x65' + bytes(4000))
+            else:
+                units.append(b'\x00\x00\x00\x01\x41' + bytes(1200))
+        return units
+
+    codec = av.CodecContext.create('libx264' if 'libx264' in av.codecs_available else 'h264', 'w')
+    codec.width, codec.height, codec.pix_fmt = width, height, 'yuv420p'
+    codec.gop_size = gop
+    codec.options = {'bf': '0', 'repeat-headers': '1'} if codec.name == 'libx264' else {'bf': '0'}
+    gradient = np.add.outer(np.arange(height), np.arange(width)).astype(np.uint8)
+    units = []
+    for i in range(frames):
+        image = np.dstack([gradient + 4 * i, gradient[::-1] + 2 * i, gradient])
+        frame = av.VideoFrame.from_ndarray(image, format='rgb24')
+        frame.pts = i
+        units.extend(bytes(packet) for packet in codec.encode(frame))
+    units.extend(bytes(packet) for packet in codec.encode(None))
+    return units
+
+
+class TelloSimulator(object):
+    """
+    Local stand-in for a Tello that speaks the binary protocol. It answers conn_req,
+    acknowledges commands, sends FLIGHT_MSG, WIFI_MSG and LOG_DATA_MSG at the given
+    rates (per second, 0 turns one off) and streams H.264 at video_fps to the video
+    port from conn_req. Every packet it sends can be lost, delayed by up to jitter
+    seconds or held back behind the next one, with the given probabilities.
+
+    The time stamped into each stick command gives the command latency, kept in
+    latency; the stamp only has millisecond resolution.
+    """
+
+    def __init__(self, addr=('127.0.0.1', 8889), flight_rate=10.0, wifi_rate=1.0, log_rate=0.0, video_fps=30.0,
+                 loss=0.0, jitter=0.0, reorder=0.0, seed=None):
+        self.rates = {'flight': flight_rate, 'wifi': wifi_rate, 'log': log_rate, 'video': video_fps}
+        self.loss = loss
+        self.jitter = jitter
+        self.reorder = reorder
+        self.random = random.Random(seed)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+        self.sock.bind(addr)
+        self.sock.setblocking(False)
+        self.addr = self.sock.getsockname()
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.wheel = scheduler.TimerWheel(0.001)
+        self.timers = []
+        self.delayed = []
+        self.delay_order = itertools.count()
+        self.held = None
+        self.client = None
+        self.video_addr = None
+        self.video_units = None
+        self.video_index = 0
+        self.video_seq = 0
+        self.utc_offset = time.localtime().tm_gmtoff
+        self.start_time = time.monotonic()
+        self.latency = scheduler.JitterStats()
+        self.received = {}
+        self.sent = 0
+        self.lost = 0
+        self.reordered = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if 0 < self.rates['video'] and self.video_units is None:
+            # encode up front, not on the simulator thread
+            self.video_units = synthetic_h264()
+        self.running = True
+        self.thread = threading.Thread(target=self.__run, name='TelloSimulator', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.selector.close()
+        self.sock.close()
+
+    def __str__(self):
+        return ('sent=%d lost=%d reordered=%d commands=%s stick latency mean=%.1fms max=%.1fms' %
+                (self.sent, self.lost, self.reordered,
+                 dict(('0x%04x' % cmd, n) for cmd, n in self.received.items()),
+                 self.latency.mean * 1000, self.latency.max * 1000))
+
+    def __run(self):
+        while self.running:
+            now = time.monotonic()
+            due = self.wheel.next_tick()
+            if self.delayed:
+                due = min(due, self.delayed[0][0])
+            for key, mask in self.selector.select(max(0.0, due - now)):
+                self.__drain()
+            self.wheel.advance()
+            now = time.monotonic()
+            while self.delayed and self.delayed[0][0] <= now:
+                _, _, data, addr = heapq.heappop(self.delayed)
+                self.__transmit(data, addr)
+
+    def __drain(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            self.__handle(data, addr)
+
+    def __handle(self, data, addr):
+        if data.startswith(b'conn_req:'):
+            self.client = addr
+            self.video_addr = (addr[0], data[9] | (data[10] << 8))
+            self.sock.sendto(b'conn_ack:' + data[9:11], addr)
+            if not self.timers:
+                self.__start_streams()
+            return
+        if len(data) < 11 or data[0] != START_OF_PACKET:
+            return
+        cmd = uint16(data[5], data[6])
+        self.received[cmd] = self.received.get(cmd, 0) + 1
+        if cmd == STICK_CMD:
+            hour, minute, second, ms_low, ms_high = struct.unpack_from('<5H', data, 15)
+            sent = hour * 3600 + minute * 60 + second + (ms_low | (ms_high << 8)) / 1000.0
+            now = (time.time() + self.utc_offset) % 86400
+            self.latency.add(max(0.0, now - sent))
+        elif data[4] == 0x68:
+            # acknowledge with the same command and sequence number
+            pkt = Packet(cmd, 0x50, b'\x00')
+            pkt.fixup(uint16(data[7], data[8]))
+            self.__send(pkt.get_buffer(), self.client)
+
+    def __start_streams(self):
+        senders = {'flight': self.__send_flight_data, 'wifi': self.__send_wifi,
+                   'log': self.__send_log_data, 'video': self.__send_video_frame}
+        for name, sender in senders.items():
+            if 0 < self.rates[name]:
+                self.timers.append(self.wheel.add(sender, 1.0 / self.rates[name]))
+
+    def __send(self, data, addr):
+        if self.loss and self.random.random() < self.loss:
+            self.lost += 1
+            return
+        if self.jitter:
+            delay = self.random.uniform(0.0, self.jitter)
+            heapq.heappush(self.delayed, (time.monotonic() + delay, next(self.delay_order), data, addr))
+            return
+        self.__transmit(data, addr)
+
+    def __transmit(self, data, addr):
+        if self.held is None and self.reorder and self.random.random() < self.reorder:
+            self.held = (data, addr)
+            self.reordered += 1
+            return
+        try:
+            self.sock.sendto(data, addr)
+            self.sent += 1
+            if self.held is not None:
+                held, self.held = self.held, None
+                self.sock.sendto(*held)
+                self.sent += 1
+        except (BlockingIOError, InterruptedError):
+            self.lost += 1
+
+    def __send_flight_data(self):
+        t = time.monotonic() - self.start_time
+        payload = FlightData.LAYOUT.pack(
+            int(50 + 40 * math.sin(t)), int(10 * math.cos(t)), int(10 * math.sin(t)), 10, int(t * 10),
+            0x01, 0, max(0, 100 - int(t / 30)), 3800, 600,
+            0, 6, 0, 0, 0, 0, 0)
+        pkt = Packet(FLIGHT_MSG, 0x48, payload)
+        pkt.fixup()
+        self.__send(pkt.get_buffer(), self.client)
+
+    def __send_wifi(self):
+        pkt = Packet(WIFI_MSG, 0x48, bytes([90, 0]))
+        pkt.fixup()
+        self.__send(pkt.get_buffer(), self.client)
+
+    def __send_log_data(self):
+        t = time.monotonic() - self.start_time
+        records = (self.__log_record(LogData.ID_NEW_MVO_FEEDBACK, LogNewMvoFeedback.LAYOUT.pack(
+                       int(100 * math.cos(t)), int(100 * math.sin(t)), 0, math.sin(t), math.cos(t), -0.5) + bytes(60)) +
+                   self.__log_record(LogData.ID_IMU_ATTI, LogImuAtti.LAYOUT.pack(
+                       0.0, 0.0, -1.0, 0.0, 0.0, 0.1, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0) + bytes(32)))
+        pkt = Packet(LOG_DATA_MSG, 0x50, b'\x00' + records)
+        pkt.fixup()
+        self.__send(pkt.get_buffer(), self.client)
+
+    def __log_record(self, id, payload):
+        key = self.random.getrandbits(8)
+        return (struct.pack('<BhBHB', 0x55, len(payload) + 12, 0, id, key) + bytes(3) +
+                payload.translate(XOR_TABLES[key]) + bytes(2))
+
+    def __send_video_frame(self):
+        unit = self.video_units[self.video_index % len(self.video_units)]
+        self.video_index += 1
+        chunks = range(0, len(unit), VIDEO_PAYLOAD)
+        for index, pos in enumerate(chunks):
+            last = 0x80 if index == len(chunks) - 1 else 0
+            self.__send(bytes([self.video_seq, index | last]) + unit[pos:pos + VIDEO_PAYLOAD], self.video_addr)
+        self.video_seq = (self.video_seq + 1) & 0xff
+
+
+def main(main_args):
+    from .tello import Tello
+
+    scale = main_args.scale
+    simulator = TelloSimulator(addr=(main_args.host, main_args.port), flight_rate=10.0 * scale,
+                               wifi_rate=1.0 * scale, log_rate=main_args.log_rate * scale,
+                               video_fps=main_args.fps, loss=main_args.loss, jitter=main_args.jitter,
+                               reorder=main_args.reorder)
+    simulator.start()
+    print('simulating a Tello on %s:%d' % simulator.addr)
+    if not main_args.client:
+        try:
+            while True:
+                time.sleep(main_args.report)
+                print(simulator)
+        except KeyboardInterrupt:
+            pass
+        simulator.stop()
+        return
+
+    drone = Tello(port=main_args.client_port, tello_addr=simulator.addr, video_port=main_args.client_video_port,
+                  local_host='127.0.0.1')
+    counts = {}
+
+    def handler(event, sender, data, **args):
+        counts[event] = counts.get(event, 0) + 1
+
+    try:
+        for signal in (drone.EVENT_FLIGHT_DATA, drone.EVENT_WIFI, drone.EVENT_LOG_DATA, drone.EVENT_VIDEO_DATA):
+            drone.subscribe(signal, handler)
+        drone.connect()
+        drone.wait_for_connection(10.0)
+        drone.start_video()
+        time.sleep(main_args.duration)
+        for signal, count in counts.items():
+            print('%s: %.1f/s' % (signal, count / main_args.duration))
+        print('stick: %s' % drone.stick_scheduler.stats)
+        print(simulator)
+    finally:
+        drone.quit()
+        simulator.stop()
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate a Tello on localhost for load and latency tests.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8889, help='control port to listen on')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier on the real telemetry rates')
+    parser.add_argument('--log_rate', type=float, default=10.0, help='LOG_DATA messages per second before scaling')
+    parser.add_argument('--fps', type=float, default=30.0, help='video frames per second, 0 for no video')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability of losing a sent packet')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum extra delay of a sent packet in seconds')
+    parser.add_argument('--reorder', type=float, default=0.0, help='probability of swapping a packet with the next')
+    parser.add_argument('--report', type=float, default=5.0, help='seconds between reports')
+    parser.add_argument('--client', action='store_true', help='also run a Tello client against the simulator')
+    parser.add_argument('--client_port', type=int, default=9000, help='control port of the client')
+    parser.add_argument('--client_video_port', type=int, default=6038, help='video port of the client')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds the client runs')
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,107 @@
+import operator
+import re
+import threading
+import time
+
+import numpy as np
+
+from .protocol import FlightData
+
+STRUCT_DTYPES = {'h': '<i2', 'B': 'u1'}
+
+
+def _flight_data_dtype():
+    codes = ''.join(code * int(count or 1) for count, code in re.findall(r'(\d*)([a-zA-Z])', FlightData.LAYOUT.format))
+    return np.dtype([('time', '<f8')] +
+                    [(name, STRUCT_DTYPES[code]) for name, code in zip(FlightData.FIELDS, codes)] +
+                    [('wifi_strength', 'u1')])
+
+
+class TelemetryRecorder(object):
+    """
+    FlightData history kept as columns of one NumPy structured array, one row per
+    message with its time.time() in the time column. The array is preallocated and
+    doubles when full, so a long flight costs a few reallocations instead of an
+    object per message. to_numpy(), between() and last() return views, not copies.
+    Rows must be appended in time order.
+    """
+    DTYPE = _flight_data_dtype()
+    FIELDS = DTYPE.names
+
+    def __init__(self, capacity=4096):
+        self.data = np.zeros(capacity, dtype=self.DTYPE)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.values = operator.attrgetter(*(FlightData.FIELDS + ('wifi_strength',)))
+        self.drone = None
+
+    def __len__(self):
+        return self.size
+
+    def attach(self, drone):
+        """Record every EVENT_FLIGHT_DATA of drone."""
+        self.drone = drone
+        drone.subscribe(drone.EVENT_FLIGHT_DATA, self.__handle_event)
+
+    def detach(self):
+        if self.drone is not None:
+            self.drone.unsubscribe(self.drone.EVENT_FLIGHT_DATA, self.__handle_event)
+            self.drone = None
+
+    def append(self, flight_data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            if self.size == len(self.data):
+                self.__grow()
+            self.data[self.size] = (timestamp,) + self.values(flight_data)
+            self.size += 1
+
+    def to_numpy(self):
+        """Every row recorded so far, as a view of the store."""
+        return self.data[:self.size]
+
+    def between(self, start, end):
+        """Rows with start <= time < end."""
+        data = self.to_numpy()
+        first, last = np.searchsorted(data['time'], (start, end))
+        return data[first:last]
+
+    def last(self, seconds):
+        """Rows from the last seconds before the newest row."""
+        data = self.to_numpy()
+        if not len(data):
+            return data
+        return data[np.searchsorted(data['time'], data['time'][-1] - seconds):]
+
+    def stats(self, field, seconds):
+        """(min, mean, max) of field over the last seconds, or None if nothing was recorded."""
+        column = self.last(seconds)[field]
+        if not len(column):
+            return None
+        return column.min(), column.mean(), column.max()
+
+    def __grow(self):
+        data = np.zeros(2 * len(self.data), dtype=self.DTYPE)
+        data[:self.size] = self.data[:self.size]
+        self.data = data
+
+    def __handle_event(self, event, sender, data, **args):
+        self.append(data)
+
+
+if __name__ == '__main__':
+    recorder = TelemetryRecorder(capacity=4)
+    flight_data = FlightData()
+    for i in range(100):
+        flight_data.update_from(bytes([i, 0]) + bytes(10) + bytes([100 - i]) + bytes(11))
+        recorder.append(flight_data, timestamp=1000.0 + i * 0.1)
+
+    data = recorder.to_numpy()
+    assert len(recorder) == 100 and len(data) == 100 and data.base is not None
+    assert list(data['height'][:3]) == [0, 1, 2] and data['battery_percentage'][-1] == 1
+    assert len(recorder.between(1001.0, 1002.0)) == 10
+    low, mean, high = recorder.stats('height', 1.0)
+    assert (low, high) == (89, 99) and abs(mean - 94.0) < 1e-9
+    print('%d rows, %d bytes, height over the last second: %d/%.1f/%d' %
+          (len(recorder), data.nbytes, low, mean, high))
@@ -3,7 +3,7 @@ import socket
 import threading
 import time
 
-from . import video_stream, dispatcher, event, logger, error, state
+from . import video_stream, dispatcher, event, logger, error, state, scheduler, recorder
 from .protocol import *
 
 log = logger.Logger('Tello')
@@ -50,16 +50,21 @@ class Tello(object):
     LOG_DEBUG = logger.LOG_DEBUG
     LOG_ALL = logger.LOG_ALL
 
-    def __init__(self, port=9000):
-        self.tello_addr = ('192.168.10.1', 8889)
+    def __init__(self, port=9000, stick_rate=50.0, start_threads=True,
+                 tello_addr=('192.168.10.1', 8889), video_port=6038, local_host=''):
+        self.tello_addr = tello_addr
         self.debug = False
         self.pkt_seq_num = 0x01e4
         self.port = port
+        self.video_port = video_port
+        self.local_host = local_host
         self.udpsize = 2000
         self.left_x = 0.0
         self.left_y = 0.0
         self.right_x = 0.0
         self.right_y = 0.0
+        self.stick_command = StickCommand()
+        self.stick_scheduler = scheduler.RateScheduler(self.handle_stick_tick, stick_rate, name='StickScheduler')
         self.sock = None
         self.state = self.STATE_DISCONNECTED
         self.lock = threading.Lock()
@@ -68,14 +73,23 @@ class Tello(object):
         self.prev_video_data_time = None
         self.video_data_size = 0
         self.video_data_loss = 0
+        self.video_prev_data = None
+        self.video_prev_ts = None
+        self.video_history = []
         self.log = log
         self.exposure = 0
         self.video_encoder_rate = 4
         self.video_stream = None
         self.wifi_strength = 0
+        self.latest_flight_data = FlightData()  # latest flight data, updated in place
         self.log_data = LogData(log)
         self.log_data_file = None
         self.log_data_header_recorded = False
+        self.recorder = None
+
+        # received packet verification state
+        self.verify_packets = False
+        self.packet_drops = dict.fromkeys(PACKET_ERRORS, 0)
 
         # video zoom state
         self.zoom = False
@@ -86,14 +100,25 @@ class Tello(object):
         # File recieve state.
         self.file_recv = {}  # Map filenum -> protocol.DownloadedFile
 
-        # Create a UDP socket
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.bind(('', self.port))
-        self.sock.settimeout(2.0)
-
-        dispatcher.connect(self.__state_machine, dispatcher.signal.All)
-        threading.Thread(target=self.__recv_thread).start()
-        threading.Thread(target=self.__video_thread).start()
+        # each drone has its own dispatcher, so its events never reach other drones.
+        # The state machine takes only the events it acts on, so events nobody
+        # subscribed to (video packets in particular) can skip the dispatcher entirely
+        self.dispatcher = dispatcher.Dispatcher()
+        for signal in (self.__EVENT_CONN_REQ, self.__EVENT_CONN_ACK, self.__EVENT_TIMEOUT, self.__EVENT_QUIT_REQ):
+            self.dispatcher.connect(self.__state_machine, signal)
+        # receivers of subscribe_batch, flushed on every stick tick
+        self.batches = []
+
+        # Without threads the owner of the sockets feeds the handle_* methods instead
+        if start_threads:
+            # Create a UDP socket
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.bind((self.local_host, self.port))
+            self.sock.settimeout(2.0)
+
+            threading.Thread(target=self.__recv_thread).start()
+            threading.Thread(target=self.__video_thread).start()
+            self.stick_scheduler.start()
 
     def set_loglevel(self, level):
         """
@@ -102,6 +127,20 @@ class Tello(object):
         """
         log.set_level(level)
 
+    def set_packet_verification(self, enabled):
+        """
+        Set_packet_verification turns on size and crc checks for received packets.
+        Rejected packets are dropped before parsing and counted per cause in packet_drops.
+        """
+        self.verify_packets = enabled
+
+    def set_stick_rate(self, rate):
+        """
+        Set_stick_rate sets how many stick commands per second are sent while connected.
+        Jitter of the send times is kept in stick_scheduler.stats.
+        """
+        self.stick_scheduler.set_rate(rate)
+
     def get_video_stream(self):
         """
         Get_video_stream is used to prepare buffer object which receive video data from the drone.
@@ -132,25 +171,51 @@ class Tello(object):
             raise error.TelloError('timeout')
 
     def __send_conn_req(self):
-        port = 9617
-        port0 = (int(port / 1000) % 10) << 4 | (int(port / 100) % 10)
-        port1 = (int(port / 10) % 10) << 4 | (int(port / 1) % 10)
+        # the drone streams video to the little endian port given here (6038 -> 96 17)
+        port0, port1 = le16(self.video_port)
         buf = 'conn_req:%c%c' % (chr(port0), chr(port1))
         log.info('send connection request (cmd="%s%02x%02x")' % (str(buf[:-2]), port0, port1))
         return self.send_packet(Packet(buf))
 
     def subscribe(self, signal, handler):
         """Subscribe a event such as EVENT_CONNECTED, EVENT_FLIGHT_DATA, EVENT_VIDEO_FRAME and so on."""
-        dispatcher.connect(handler, signal)
+        self.dispatcher.connect(handler, signal)
+
+    def subscribe_queued(self, signal, handler, maxsize=64, policy=dispatcher.DROP_OLDEST, loop=None):
+        """
+        Subscribe a handler that runs on its own worker thread, or on the asyncio loop if given, so a
+        slow handler does not stall receiving. Up to maxsize events wait for it; policy is one of
+        dispatcher.DROP_OLDEST, DROP_NEWEST or BLOCK. Returns the queue, which tracks lag and drops.
+        """
+        return self.dispatcher.connect_queued(handler, signal, maxsize, policy, loop)
+
+    def subscribe_batch(self, signal, handler, maxlen=None):
+        """
+        Subscribe a handler that gets the events of one stick tick as a list, called from the stick
+        tick after the stick command went out. Returns the dispatcher.Batch, pass it to unsubscribe.
+        """
+        batch = dispatcher.Batch(handler, maxlen)
+        self.dispatcher.connect(batch, signal)
+        # replaced rather than appended to, the stick tick iterates it without the lock
+        self.batches = self.batches + [batch]
+        return batch
+
+    def unsubscribe(self, signal, handler):
+        """Unsubscribe a handler from a event, or from every event if signal is dispatcher.signal.All."""
+        self.dispatcher.disconnect(handler, signal)
+        if handler in self.batches:
+            self.batches = [batch for batch in self.batches if batch is not handler]
 
     def __publish(self, event, data=None, **args):
+        if not self.dispatcher.has_receivers(event):
+            return
         args.update({'data': data})
         if 'signal' in args:
             del args['signal']
         if 'sender' in args:
             del args['sender']
-        log.debug('publish signal=%s, args=%s' % (event, args))
-        dispatcher.send(event, sender=self, **args)
+        log.debug('publish signal=%s, args=%s', event, args)
+        self.dispatcher.send(event, sender=self, **args)
 
     def takeoff(self):
         """Takeoff tells the drones to liftoff and start flying."""
@@ -192,11 +257,12 @@ class Tello(object):
         """Quit stops the internal threads."""
         log.info('quit')
         self.__publish(event=self.__EVENT_QUIT_REQ)
+        self.stop_recording()
 
     def get_alt_limit(self):
         ''' ... '''
-        self.log.debug('get altitude limit (cmd=0x%02x seq=0x%04x)' % (
-            ALT_LIMIT_MSG, self.pkt_seq_num))
+        self.log.debug('get altitude limit (cmd=0x%02x seq=0x%04x)',
+                       ALT_LIMIT_MSG, self.pkt_seq_num)
         pkt = Packet(ALT_LIMIT_MSG)
         pkt.fixup()
         return self.send_packet(pkt)
@@ -213,8 +279,8 @@ class Tello(object):
 
     def get_att_limit(self):
         ''' ... '''
-        self.log.debug('get attitude limit (cmd=0x%02x seq=0x%04x)' % (
-            ATT_LIMIT_MSG, self.pkt_seq_num))
+        self.log.debug('get attitude limit (cmd=0x%02x seq=0x%04x)',
+                       ATT_LIMIT_MSG, self.pkt_seq_num)
         pkt = Packet(ATT_LIMIT_MSG)
         pkt.fixup()
         return self.send_packet(pkt)
@@ -233,8 +299,8 @@ class Tello(object):
 
     def get_low_bat_threshold(self):
         ''' ... '''
-        self.log.debug('get low battery threshold (cmd=0x%02x seq=0x%04x)' % (
-            LOW_BAT_THRESHOLD_MSG, self.pkt_seq_num))
+        self.log.debug('get low battery threshold (cmd=0x%02x seq=0x%04x)',
+                       LOW_BAT_THRESHOLD_MSG, self.pkt_seq_num)
         pkt = Packet(LOW_BAT_THRESHOLD_MSG)
         pkt.fixup()
         return self.send_packet(pkt)
@@ -482,41 +548,7 @@ class Tello(object):
         self.fast_mode = False
 
     def __send_stick_command(self):
-        pkt = Packet(STICK_CMD, 0x60)
-
-        axis1 = int(1024 + 660.0 * self.right_x) & 0x7ff
-        axis2 = int(1024 + 660.0 * self.right_y) & 0x7ff
-        axis3 = int(1024 + 660.0 * self.left_y) & 0x7ff
-        axis4 = int(1024 + 660.0 * self.left_x) & 0x7ff
-        axis5 = int(self.fast_mode) & 0x01
-        '''
-        11 bits (-1024 ~ +1023) x 4 axis = 44 bits
-        fast_mode takes 1 bit        
-        44 bits will be packed in to 6 bytes (48 bits)
-
-                    axis4      axis3      axis2      axis1
-             |          |          |          |          |
-                 4         3         2         1         0
-        98765432109876543210987654321098765432109876543210
-         |       |       |       |       |       |       |
-             byte5   byte4   byte3   byte2   byte1   byte0
-        '''
-        log.debug("stick command: fast=%d yaw=%4d thr=%4d pit=%4d rol=%4d" %
-                  (axis5, axis4, axis3, axis2, axis1))
-        log.debug("stick command: fast=%04x yaw=%04x thr=%04x pit=%04x rol=%04x" %
-                  (axis5, axis4, axis3, axis2, axis1))
-        packed = axis1 | (axis2 << 11) | (
-                axis3 << 22) | (axis4 << 33) | (axis5 << 44)
-        packed_bytes = struct.pack('<Q', packed)
-        pkt.add_byte(byte(packed_bytes[0]))
-        pkt.add_byte(byte(packed_bytes[1]))
-        pkt.add_byte(byte(packed_bytes[2]))
-        pkt.add_byte(byte(packed_bytes[3]))
-        pkt.add_byte(byte(packed_bytes[4]))
-        pkt.add_byte(byte(packed_bytes[5]))
-        pkt.add_time()
-        pkt.fixup()
-        log.debug("stick command: %s" % byte_to_hexstring(pkt.get_buffer()))
+        pkt = self.stick_command.update(self.right_x, self.right_y, self.left_y, self.left_x, self.fast_mode)
         return self.send_packet(pkt)
 
     def __send_ack_log(self, id):
@@ -530,10 +562,16 @@ class Tello(object):
 
     def send_packet(self, pkt):
         """Send_packet is used to send a command packet to the drone."""
+        if self.sock is None:
+            # not opened yet, or replaying a recording
+            return False
         try:
             cmd = pkt.get_buffer()
             self.sock.sendto(cmd, self.tello_addr)
-            log.debug("send_packet: %s" % byte_to_hexstring(cmd))
+            log.debug("send_packet: %s", HexString(cmd))
+            rec = self.recorder
+            if rec is not None:
+                rec.write(recorder.CONTROL_OUT, cmd)
         except socket.error as err:
             if self.state == self.STATE_CONNECTED:
                 log.error("send_packet: %s" % str(err))
@@ -554,7 +592,7 @@ class Tello(object):
 
         if str(data[0:9]) == 'conn_ack:' or data[0:9] == b'conn_ack:':
             log.info('connected. (port=%2x%2x)' % (data[9], data[10]))
-            log.debug('    %s' % byte_to_hexstring(data))
+            log.debug('    %s', HexString(data))
             if self.video_enabled:
                 self.__send_exposure()
                 self.__send_video_encoder_rate()
@@ -564,24 +602,31 @@ class Tello(object):
             return True
 
         if data[0] != START_OF_PACKET:
+            self.packet_drops[PACKET_BAD_START] += 1
             log.info('start of packet != %02x (%02x) (ignored)' % (START_OF_PACKET, data[0]))
             log.info('    %s' % byte_to_hexstring(data))
             log.info('    %s' % str(map(chr, data))[1:-1])
             return False
 
+        if self.verify_packets:
+            reason = verify_packet(data)
+            if reason is not None:
+                self.packet_drops[reason] += 1
+                return False
+
         pkt = Packet(data)
         cmd = uint16(data[5], data[6])
         if cmd == LOG_HEADER_MSG:
             id = uint16(data[9], data[10])
             log.info("recv: log_header: id=%04x, '%s'" % (id, str(data[28:54])))
-            log.debug("recv: log_header: %s" % byte_to_hexstring(data[9:]))
+            log.debug("recv: log_header: %s", HexString(data[9:]))
             self.__send_ack_log(id)
             self.__publish(event=self.EVENT_LOG_HEADER, data=data[9:])
             if self.log_data_file and not self.log_data_header_recorded:
                 self.log_data_file.write(data[12:-2])
                 self.log_data_header_recorded = True
         elif cmd == LOG_DATA_MSG:
-            log.debug("recv: log_data: length=%d, %s" % (len(data[9:]), byte_to_hexstring(data[9:])))
+            log.debug("recv: log_data: length=%d, %s", len(data[9:]), HexString(data[9:]))
             self.__publish(event=self.EVENT_LOG_RAWDATA, data=data[9:])
             try:
                 self.log_data.update(data[10:])
@@ -592,10 +637,10 @@ class Tello(object):
             self.__publish(event=self.EVENT_LOG_DATA, data=self.log_data)
 
         elif cmd == LOG_CONFIG_MSG:
-            log.debug("recv: log_config: length=%d, %s" % (len(data[9:]), byte_to_hexstring(data[9:])))
+            log.debug("recv: log_config: length=%d, %s", len(data[9:]), HexString(data[9:]))
             self.__publish(event=self.EVENT_LOG_CONFIG, data=data[9:])
         elif cmd == WIFI_MSG:
-            log.debug("recv: wifi: %s" % byte_to_hexstring(data[9:]))
+            log.debug("recv: wifi: %s", HexString(data[9:]))
             self.wifi_strength = data[9]
             self.__publish(event=self.EVENT_WIFI, data=data[9:])
         elif cmd == ALT_LIMIT_MSG:
@@ -605,21 +650,23 @@ class Tello(object):
         elif cmd == LOW_BAT_THRESHOLD_MSG:
             log.info("recv: low battery threshold: %s" % byte_to_hexstring(data[9:-2]))
         elif cmd == LIGHT_MSG:
-            log.debug("recv: light: %s" % byte_to_hexstring(data[9:-2]))
+            log.debug("recv: light: %s", HexString(data[9:-2]))
             self.__publish(event=self.EVENT_LIGHT, data=data[9:])
         elif cmd == FLIGHT_MSG:
-            flight_data = FlightData(data[9:])
-            flight_data.wifi_strength = self.wifi_strength
-            log.debug("recv: flight data: %s" % str(flight_data))
-            self.__publish(event=self.EVENT_FLIGHT_DATA, data=flight_data)
+            self.latest_flight_data.update_from(data[9:])
+            self.latest_flight_data.wifi_strength = self.wifi_strength
+            log.debug("recv: flight data: %s", self.latest_flight_data)
+            if self.dispatcher.has_receivers(self.EVENT_FLIGHT_DATA):
+                # subscribers may keep what they get, so they get their own instance
+                self.__publish(event=self.EVENT_FLIGHT_DATA, data=self.latest_flight_data.copy())
         elif cmd == TIME_CMD:
-            log.debug("recv: time data: %s" % byte_to_hexstring(data))
+            log.debug("recv: time data: %s", HexString(data))
             self.__publish(event=self.EVENT_TIME, data=data[7:9])
         elif cmd in (SET_ALT_LIMIT_CMD, ATT_LIMIT_CMD, LOW_BAT_THRESHOLD_CMD, TAKEOFF_CMD, LAND_CMD, VIDEO_START_CMD,
                      VIDEO_ENCODER_RATE_CMD, PALM_LAND_CMD,
                      EXPOSURE_CMD, THROW_AND_GO_CMD, EMERGENCY_CMD):
-            log.debug("recv: ack: cmd=0x%02x seq=0x%04x %s" %
-                      (uint16(data[5], data[6]), uint16(data[7], data[8]), byte_to_hexstring(data)))
+            log.debug("recv: ack: cmd=0x%02x seq=0x%04x %s",
+                      uint16(data[5], data[6]), uint16(data[7], data[8]), HexString(data))
         elif cmd == TELLO_CMD_FILE_SIZE:
             # Drone is about to send us a file. Get ready.
             # N.b. one of the fields in the packet is a file ID; by demuxing
@@ -684,12 +731,30 @@ class Tello(object):
         log.info('record log data in %s' % path)
         self.log_data_file = open(path, 'wb')
 
+    def start_recording(self, path=None):
+        """
+        Start_recording writes every packet sent and received, video included, with its time
+        into path. Read it back with recorder.FlightLog.
+        """
+        if path is None:
+            path = '%s/Documents/tello-%s.rec' % (
+                os.getenv('HOME'),
+                datetime.datetime.now().strftime('%Y-%m-%d_%H%M%S'))
+        log.info('record flight in %s' % path)
+        self.stop_recording()
+        self.recorder = recorder.FlightRecorder(path)
+
+    def stop_recording(self):
+        rec, self.recorder = self.recorder, None
+        if rec is not None:
+            rec.close()
+
     def __state_machine(self, event, sender, data, **args):
         self.lock.acquire()
         cur_state = self.state
         event_connected = False
         event_disconnected = False
-        log.debug('event %s in state %s' % (str(event), str(self.state)))
+        log.debug('event %s in state %s', event, self.state)
 
         if self.state == self.STATE_DISCONNECTED:
             if event == self.__EVENT_CONN_REQ:
@@ -736,109 +801,132 @@ class Tello(object):
             self.__publish(event=self.EVENT_DISCONNECTED, **args)
             self.connected.clear()
 
+    def handle_packet(self, data):
+        """Handle_packet processes one datagram received on the control port."""
+        log.debug("recv: %s", HexString(data))
+        rec = self.recorder
+        if rec is not None:
+            rec.write(recorder.CONTROL_IN, data)
+        return self.__process_packet(data)
+
+    def handle_timeout(self):
+        """Handle_timeout is called when nothing arrived on the control port for 2 seconds."""
+        if self.state == self.STATE_CONNECTED:
+            log.error('recv: timeout')
+        self.__publish(event=self.__EVENT_TIMEOUT)
+
+    def handle_stick_tick(self):
+        """Handle_stick_tick sends the stick positions if connected and flushes the batches. Call it at the stick rate."""
+        if self.state == self.STATE_CONNECTED:
+            self.__send_stick_command()  # ignore errors
+        for batch in self.batches:
+            batch.flush()
+
+    def handle_video_packet(self, data):
+        """Handle_video_packet processes one datagram received on the video port."""
+        now = datetime.datetime.now()
+        log.debug("video recv: %s %d bytes", HexString(data[0:2]), len(data))
+        rec = self.recorder
+        if rec is not None:
+            rec.write(recorder.VIDEO_IN, data)
+        show_history = False
+
+        # check video data loss
+        video_data = VideoData(data)
+        loss = video_data.gap(self.video_prev_data)
+        if loss != 0:
+            self.video_data_loss += loss
+            # enable this line to see packet history
+            # show_history = True
+        self.video_prev_data = video_data
+
+        # check video data interval
+        prev_ts = self.video_prev_ts
+        if prev_ts is not None and 0.1 < (now - prev_ts).total_seconds():
+            log.info('video recv: %d bytes %02x%02x +%03d' %
+                     (len(data), byte(data[0]), byte(data[1]),
+                      (now - prev_ts).total_seconds() * 1000))
+        self.video_prev_ts = now
+
+        # save video data history
+        history = self.video_history
+        history.append([now, len(data), byte(data[0]) * 256 + byte(data[1])])
+        if 100 < len(history):
+            del history[0]
+
+        # show video data history
+        if show_history:
+            prev_ts = history[0][0]
+            for i in range(1, len(history)):
+                [ts, sz, sn] = history[i]
+                log.info('    %02d:%02d:%02d.%03d %4d bytes %04x +%03d%s' %
+                         (ts.hour, ts.minute, ts.second, ts.microsecond / 1000,
+                          sz, sn, (ts - prev_ts).total_seconds() * 1000,
+                          (' *' if i == len(history) - 1 else '')))
+                prev_ts = ts
+            del history[:-1]
+
+        # deliver video frame to subscribers, without slicing the payload if there are none
+        if self.dispatcher.has_receivers(self.EVENT_VIDEO_FRAME):
+            self.__publish(event=self.EVENT_VIDEO_FRAME, data=data[2:])
+        self.__publish(event=self.EVENT_VIDEO_DATA, data=data)
+
+        # show video frame statistics
+        if self.prev_video_data_time is None:
+            self.prev_video_data_time = now
+        self.video_data_size += len(data)
+        dur = (now - self.prev_video_data_time).total_seconds()
+        if 2.0 < dur:
+            log.info(('video data %d bytes %5.1fKB/sec' %
+                      (self.video_data_size, self.video_data_size / dur / 1024)) +
+                     ((' loss=%d' % self.video_data_loss) if self.video_data_loss != 0 else ''))
+            self.video_data_size = 0
+            self.prev_video_data_time = now
+            self.video_data_loss = 0
+
+            # keep sending start video command
+            self.__send_start_video()
+
+    def handle_video_timeout(self):
+        """Handle_video_timeout is called when video is enabled but nothing arrived for 1 second."""
+        log.error('video recv: timeout')
+        self.start_video()
+
     def __recv_thread(self):
         sock = self.sock
 
         while self.state != self.STATE_QUIT:
-
-            if self.state == self.STATE_CONNECTED:
-                self.__send_stick_command()  # ignore errors
-
             try:
                 data, server = sock.recvfrom(self.udpsize)
-                log.debug("recv: %s" % byte_to_hexstring(data))
-                self.__process_packet(data)
+                self.handle_packet(data)
             except socket.timeout as ex:
-                if self.state == self.STATE_CONNECTED:
-                    log.error('recv: timeout')
-                self.__publish(event=self.__EVENT_TIMEOUT)
+                self.handle_timeout()
             except Exception as ex:
                 log.error('recv: %s' % str(ex))
                 show_exception(ex)
 
+        self.stick_scheduler.stop()
         log.info('exit from the recv thread.')
 
     def __video_thread(self):
         log.info('start video thread')
         # Create a UDP socket
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        port = 6038
-        sock.bind(('', port))
+        sock.bind((self.local_host, self.video_port))
         sock.settimeout(1.0)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 512 * 1024)
         log.info('video receive buffer size = %d' %
                  sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF))
 
-        prev_video_data = None
-        prev_ts = None
-        history = []
         while self.state != self.STATE_QUIT:
             if not self.video_enabled:
                 time.sleep(1.0)
                 continue
             try:
                 data, server = sock.recvfrom(self.udpsize)
-                now = datetime.datetime.now()
-                log.debug("video recv: %s %d bytes" % (byte_to_hexstring(data[0:2]), len(data)))
-                show_history = False
-
-                # check video data loss
-                video_data = VideoData(data)
-                loss = video_data.gap(prev_video_data)
-                if loss != 0:
-                    self.video_data_loss += loss
-                    # enable this line to see packet history
-                    # show_history = True
-                prev_video_data = video_data
-
-                # check video data interval
-                if prev_ts is not None and 0.1 < (now - prev_ts).total_seconds():
-                    log.info('video recv: %d bytes %02x%02x +%03d' %
-                             (len(data), byte(data[0]), byte(data[1]),
-                              (now - prev_ts).total_seconds() * 1000))
-                prev_ts = now
-
-                # save video data history
-                history.append([now, len(data), byte(data[0]) * 256 + byte(data[1])])
-                if 100 < len(history):
-                    history = history[1:]
-
-                # show video data history
-                if show_history:
-                    prev_ts = history[0][0]
-                    for i in range(1, len(history)):
-                        [ts, sz, sn] = history[i]
-                        log.info('    %02d:%02d:%02d.%03d %4d bytes %04x +%03d%s' %
-                              (ts.hour, ts.minute, ts.second, ts.microsecond / 1000,
-                               sz, sn, (ts - prev_ts).total_seconds() * 1000,
-                               (' *' if i == len(history) - 1 else '')))
-                        prev_ts = ts
-                    history = history[-1:]
-
-                # deliver video frame to subscribers
-                self.__publish(event=self.EVENT_VIDEO_FRAME, data=data[2:])
-                self.__publish(event=self.EVENT_VIDEO_DATA, data=data)
-
-                # show video frame statistics
-                if self.prev_video_data_time is None:
-                    self.prev_video_data_time = now
-                self.video_data_size += len(data)
-                dur = (now - self.prev_video_data_time).total_seconds()
-                if 2.0 < dur:
-                    log.info(('video data %d bytes %5.1fKB/sec' %
-                              (self.video_data_size, self.video_data_size / dur / 1024)) +
-                             ((' loss=%d' % self.video_data_loss) if self.video_data_loss != 0 else ''))
-                    self.video_data_size = 0
-                    self.prev_video_data_time = now
-                    self.video_data_loss = 0
-
-                    # keep sending start video command
-                    self.__send_start_video()
-
+                self.handle_video_packet(data)
             except socket.timeout as ex:
-                log.error('video recv: timeout')
-                self.start_video()
-                data = None
+                self.handle_video_timeout()
             except Exception as ex:
                 log.error('video recv: %s' % str(ex))
                 show_exception(ex)
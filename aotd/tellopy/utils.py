@@ -31,6 +31,17 @@ def byte_to_hexstring(buf):
     return ''.join(["%02x " % ord(chr(x)) for x in buf]).strip()
 
 
+class HexString(object):
+    """Byte_to_hexstring done on str(), so log calls only pay for it when the message is written."""
+    __slots__ = ('buf',)
+
+    def __init__(self, buf):
+        self.buf = buf
+
+    def __str__(self):
+        return byte_to_hexstring(self.buf)
+
+
 def float_to_hex(f):
     return hex(struct.unpack('<I', struct.pack('<f', f))[0])
 
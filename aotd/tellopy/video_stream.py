@@ -1,35 +1,185 @@
+import collections
 import threading
+import time
 from . protocol import *
 
+# H.264 NAL unit types
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SEI = 6
+NAL_SPS = 7
+NAL_PPS = 8
+
+START_CODE = b'\x00\x00\x01'
+
+
+def nal_headers(buf, start=0):
+    """NAL header bytes that follow each Annex B start code in buf[start:]."""
+    headers = []
+    pos = buf.find(START_CODE, start)
+    while 0 <= pos and pos + 3 < len(buf):
+        headers.append(buf[pos + 3])
+        pos = buf.find(START_CODE, pos + 3)
+    return headers
+
+
+class RingBuffer(object):
+    """
+    Preallocated byte ring. Data is copied straight in from any bytes-like object
+    (slices of a memoryview included) and out with a single copy, into the caller's
+    buffer or into one new bytes object.
+    Writes stay pending, invisible to readers, until commit() or rollback().
+    Not thread safe by itself, VideoStream holds its condition around every call.
+    """
+
+    def __init__(self, capacity):
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.capacity = capacity
+        self.head = 0
+        self.size = 0
+        self.pending = 0
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+        self.pending = 0
+
+    def write(self, data):
+        n = len(data)
+        if self.capacity - self.size - self.pending < n:
+            return False
+        tail = (self.head + self.size + self.pending) % self.capacity
+        first = min(n, self.capacity - tail)
+        self.view[tail:tail + first] = data[:first]
+        if first < n:
+            self.view[:n - first] = data[first:]
+        self.pending += n
+        return True
+
+    def commit(self):
+        self.size += self.pending
+        self.pending = 0
+
+    def rollback(self):
+        self.pending = 0
+
+    def read(self, size):
+        """Up to size bytes as one bytes object, copied once out of the ring."""
+        n = min(size, self.size)
+        first = min(n, self.capacity - self.head)
+        data = b''.join((self.view[self.head:self.head + first], self.view[:n - first]))
+        self.head = (self.head + n) % self.capacity
+        self.size -= n
+        return data
+
+    def readinto(self, out):
+        out = memoryview(out).cast('B')
+        n = min(len(out), self.size)
+        first = min(n, self.capacity - self.head)
+        out[:first] = self.view[self.head:self.head + first]
+        if first < n:
+            out[first:n] = self.view[:n - first]
+        self.head = (self.head + n) % self.capacity
+        self.size -= n
+        return n
+
+
+class VideoFrame(object):
+    """Bookkeeping for one frame (access unit) of the video stream."""
+
+    def __init__(self, seq, timestamp):
+        self.seq = seq
+        self.time = timestamp
+        self.size = 0
+        self.packets = 0
+        self.nal_types = []
+        self.keyframe = False
+        self.reference = True
+        self.queued = False
+        self.complete = False
+
+    def add_nal_headers(self, headers):
+        for header in headers:
+            nal_type = header & 0x1f
+            self.nal_types.append(nal_type)
+            if nal_type in (NAL_IDR, NAL_SPS):
+                self.keyframe = True
+            if nal_type in (NAL_SLICE, NAL_IDR):
+                self.reference = (header >> 5) & 0x3 != 0
+
+    def __str__(self):
+        return ('frame %02x: %6d bytes %2d packets nal=%s%s%s' %
+                (self.seq, self.size, self.packets, self.nal_types,
+                 ' key' if self.keyframe else '', '' if self.queued else ' dropped'))
+
 
 class VideoStream(object):
-    def __init__(self, drone):
+    """
+    File-like H.264 stream for av.open(). Packets are assembled into whole frames
+    using the sequence bytes of VideoData, streamed without their 2-byte header into
+    a ring buffer, and only become readable once the frame is complete.
+
+    When the reader falls behind and the ring passes high_water bytes, frames are
+    dropped whole: non-reference frames first, and once a reference frame has to go,
+    everything up to the next keyframe, which is requested from the drone right away.
+    A reference frame that lost a packet, or a gap in the sequence bytes, is handled the same way.
+    The last FRAME_HISTORY frames are kept in frames with their time, size and NAL types.
+    """
+    CAPACITY = 2 * 1024 * 1024
+    HIGH_WATER = 3 * CAPACITY // 4
+    FRAME_HISTORY = 300
+
+    def __init__(self, drone, capacity=CAPACITY, high_water=HIGH_WATER):
         self.drone = drone
         self.log = drone.log
         self.cond = threading.Condition()
-        self.queue = []
+        self.ring = RingBuffer(capacity)
+        self.high_water = min(high_water, capacity)
+        self.frames = collections.deque(maxlen=self.FRAME_HISTORY)
+        self.frame = None
+        self.prev_seq = None
+        self.last_flag_seen = False
+        self.wait_keyframe = False
+        self.dropped_frames = 0
+        self.lost_frames = 0
+        self.dropped_bytes = 0
         self.closed = False
-        self.prev_video_data = None
-        self.wait_first_packet_in_frame = True
         self.ignore_packets = 0
         self.name = 'VideoStream'
         drone.subscribe(drone.EVENT_CONNECTED, self.__handle_event)
         drone.subscribe(drone.EVENT_DISCONNECTED, self.__handle_event)
         drone.subscribe(drone.EVENT_VIDEO_DATA, self.__handle_event)
 
+    def readinto(self, buf):
+        """
+        Fill buf with as much buffered video as fits and return the byte count. PyAV
+        only ever calls read(), this is for readers that bring their own buffer.
+        """
+        self.cond.acquire()
+        try:
+            if len(self.ring) == 0 and not self.closed:
+                self.cond.wait(5.0)
+            n = self.ring.readinto(buf)
+        finally:
+            self.cond.release()
+        # returning zero bytes indicates end of stream
+        self.log.debug('%s.readinto(size=%d) = %d', self.name, len(buf), n)
+        return n
+
     def read(self, size):
         self.cond.acquire()
         try:
-            if len(self.queue) == 0 and not self.closed:
+            if len(self.ring) == 0 and not self.closed:
                 self.cond.wait(5.0)
-            data = bytes()
-            while 0 < len(self.queue) and len(data) + len(self.queue[0]) < size:
-                data = data + self.queue[0]
-                del self.queue[0]
+            data = self.ring.read(size)
         finally:
             self.cond.release()
         # returning data of zero length indicates end of stream
-        self.log.debug('%s.read(size=%d) = %d' % (self.name, size, len(data)))
+        self.log.debug('%s.read(size=%d) = %d', self.name, size, len(data))
         return data
 
     def seek(self, offset, whence):
@@ -42,27 +192,102 @@ class VideoStream(object):
         elif event is self.drone.EVENT_DISCONNECTED:
             self.log.info('%s.handle_event(DISCONNECTED)' % (self.name))
             self.cond.acquire()
-            self.queue = []
+            self.ring.clear()
+            self.frame = None
+            self.prev_seq = None
             self.closed = True
             self.cond.notifyAll()
             self.cond.release()
         elif event is self.drone.EVENT_VIDEO_DATA:
-            self.log.debug('%s.handle_event(VIDEO_DATA, size=%d)' % (self.name, len(data)))
-            video_data = VideoData(data)
-            if 0 < video_data.gap(self.prev_video_data):
-                self.wait_first_packet_in_frame = True
-                
-            self.prev_video_data = video_data
-            if self.wait_first_packet_in_frame and byte(data[1]) != 0:
-                self.ignore_packets += 1
-                return
-            if self.wait_first_packet_in_frame:
-                self.log.debug('%s.handle_event(VIDEO_DATA): ignore %d packets' %
-                               (self.name, self.ignore_packets))
+            self.log.debug('%s.handle_event(VIDEO_DATA, size=%d)', self.name, len(data))
+            self.cond.acquire()
+            try:
+                self.__add_packet(data)
+            finally:
+                self.cond.release()
+
+    def __add_packet(self, data):
+        seq = byte(data[0])
+        index = byte(data[1]) & 0x7f
+        last = byte(data[1]) & 0x80
+        payload = memoryview(data)[2:]
+
+        if index == 0:
+            if self.frame is not None:
+                # without end-of-frame flags the next frame start is what closes a frame
+                self.__end_frame(complete=not self.last_flag_seen)
+            self.__begin_frame(seq, data, payload)
+        elif self.frame is None:
+            self.ignore_packets += 1
+            return
+        elif seq != self.frame.seq or index != self.frame.packets:
+            self.log.debug('%s: lost packet in frame %02x', self.name, self.frame.seq)
+            self.__end_frame(complete=False)
+            self.ignore_packets += 1
+            return
+        else:
+            self.__add_payload(payload)
+            self.frame.add_nal_headers(nal_headers(data, 2))
+
+        if last:
+            self.last_flag_seen = True
+            self.__end_frame(complete=True)
+
+    def __begin_frame(self, seq, data, payload):
+        if self.ignore_packets:
+            self.log.debug('%s.handle_event(VIDEO_DATA): ignore %d packets',
+                           self.name, self.ignore_packets)
             self.ignore_packets = 0
-            self.wait_first_packet_in_frame = False
+        if self.prev_seq is not None and seq != (self.prev_seq + 1) & 0xff:
+            # whole frames went missing, there is no telling whether they were referenced
+            self.lost_frames += (seq - self.prev_seq - 1) & 0xff
+            self.__request_keyframe('lost a reference frame')
+        self.prev_seq = seq
+        frame = self.frame = VideoFrame(seq, time.monotonic())
+        frame.add_nal_headers(nal_headers(data, 2))
+        frame.queued = True
 
-            self.cond.acquire()
-            self.queue.append(data[2:])
+        if frame.keyframe:
+            self.wait_keyframe = False
+        if self.wait_keyframe:
+            frame.queued = False
+        elif self.high_water < len(self.ring):
+            frame.queued = False
+            if frame.reference:
+                self.__request_keyframe()
+        self.__add_payload(payload)
+
+    def __add_payload(self, payload):
+        frame = self.frame
+        frame.packets += 1
+        frame.size += len(payload)
+        if frame.queued and not self.ring.write(payload):
+            self.ring.rollback()
+            frame.queued = False
+            self.__request_keyframe()
+
+    def __end_frame(self, complete):
+        frame = self.frame
+        self.frame = None
+        frame.complete = complete
+        if frame.queued and complete:
+            self.ring.commit()
             self.cond.notifyAll()
-            self.cond.release()
+        else:
+            self.ring.rollback()
+            if not complete:
+                self.lost_frames += 1
+                if frame.reference:
+                    # later frames refer to the one that was lost, none of them decode until the next keyframe
+                    self.__request_keyframe('lost a reference frame')
+            else:
+                self.dropped_frames += 1
+                self.dropped_bytes += frame.size
+            frame.queued = False
+        self.frames.append(frame)
+
+    def __request_keyframe(self, reason='reader is behind'):
+        if not self.wait_keyframe:
+            self.log.info('%s: %s, dropping frames up to the next keyframe' % (self.name, reason))
+            self.wait_keyframe = True
+            self.drone.start_video()
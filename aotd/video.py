@@ -0,0 +1,91 @@
+"""
+@title
+
+video.py
+
+@description
+
+Low latency consumption of the drone video stream. A background thread decodes
+every frame and keeps only the most recent one, so a slow consumer always works on
+the freshest image instead of falling further behind the live stream. Frames are
+converted to BGR only when a consumer takes them, skipped frames never are.
+
+"""
+import threading
+import time
+
+import av
+import av.error
+
+
+class LatestFrameDecoder:
+
+    def __init__(self, stream, retry=3):
+        self.stream = stream
+        self.retry = retry
+
+        self.container = None
+        self.decode_thread = None
+        self._running = False
+        self.decoded = 0
+        self.consumed = 0
+        # single slot holding (frame number, av.VideoFrame, monotonic decode time).
+        # The tuple is replaced in one assignment, so readers never take a lock.
+        self.latest = None
+        # (frame number, bgr image, decode time) of the last frame handed out
+        self.converted = None
+        return
+
+    def start(self):
+        retry = self.retry
+        while self.container is None and 0 < retry:
+            retry -= 1
+            try:
+                self.container = av.open(self.stream)
+            except av.error.FFmpegError as ave:
+                print(ave)
+                print('retry...')
+        if self.container is None:
+            raise RuntimeError('unable to open the video stream')
+
+        self._running = True
+        self.decode_thread = threading.Thread(target=self.__decode, daemon=True)
+        self.decode_thread.start()
+        return
+
+    def stop(self):
+        self._running = False
+        return
+
+    def get_latest_frame(self, newer_than=None):
+        """
+        Returns the most recent (frame number, image, decode time) without blocking. Returns None if
+        nothing has been decoded yet, or if nothing newer than the frame number newer_than has arrived.
+        """
+        latest = self.latest
+        if latest is None or (newer_than is not None and latest[0] <= newer_than):
+            return None
+        converted = self.converted
+        if converted is None or converted[0] != latest[0]:
+            frame_num, frame, decode_time = latest
+            converted = self.converted = (frame_num, frame.to_ndarray(format='bgr24'), decode_time)
+            self.consumed += 1
+        return converted
+
+    def skipped(self):
+        return self.decoded - self.consumed
+
+    def __decode(self):
+        while self._running:
+            try:
+                for frame in self.container.decode(video=0):
+                    if not self._running:
+                        break
+                    self.decoded += 1
+                    self.latest = (self.decoded, frame, time.monotonic())
+            except av.error.EOFError:
+                # the drone disconnected and the stream was closed
+                self._running = False
+            except av.error.FFmpegError as ave:
+                print(ave)
+        return
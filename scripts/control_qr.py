@@ -1,14 +1,13 @@
 import threading
 import time
 
-import av
 import cv2 as cv2  # for avoidance of pylint error
-import numpy
 import numpy as np
 import pygame
 
-from aotd.cv import detect_qr, dense_optical_flow, vectors_to_commands, poly_area, draw_text
+from aotd.cv import FrameCache, QRTracker, SparseFlow, flow_to_commands, poly_area, draw_text
 from aotd.tellopy.tello import Tello
+from aotd.video import LatestFrameDecoder
 
 MENU = """
 SPACE: Takeoff (If on ground)
@@ -20,9 +19,6 @@ C:     Connect to drone ssid
 
 def main():
     def video_handler():
-        # skip first N frames
-        # skip first 300 frames
-        frame_skip = 300
         video_running = True
 
         # positive value is first command, negative is second command
@@ -48,65 +44,59 @@ def main():
 
         rad = 50
         true_info = r'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+        qr_tracker = QRTracker()
+        optical_flow = SparseFlow()
+        print('video running')
+        frame_num = None
         while video_running:
-            print('video running')
-            for frame in container.decode(video=0):
-                if 0 < frame_skip:
-                    frame_skip = frame_skip - 1
-                    prev_image = frame.to_image()
-                    prev_image = cv2.cvtColor(numpy.array(prev_image), cv2.COLOR_RGB2BGR)
-                    continue
-                start_time = time.time()
-
-                video_frame = frame.to_image()
-                image = cv2.cvtColor(numpy.array(video_frame), cv2.COLOR_RGB2BGR)
-                detected, points, info, qr_frame = detect_qr(image)
-                if detected:
-                    # get center of all points
-                    # draw circle around QR code
-                    points = np.array(points[0])
-                    x_points = points[:, 0]
-                    y_points = points[:, 1]
-                    area = poly_area(x_points, y_points)
-                    size_proportion = area / prev_area
-                    if size_proportion < 0.5:
-                        print(f'{area=} | {size_proportion=}')
-
-                    center = tuple(np.mean(points, axis=0).astype(int))
-                    cv2.circle(image, center, rad, color=(255, 0, 0), thickness=2)
-
-                    flow, x_vectors, y_vectors = dense_optical_flow(prev_image, curr_frame=image)
-
-                    prev_image = image
-                    prev_area = area
-
-                    command = vectors_to_commands(x_vectors, y_vectors, size_proportion, center, rad)
-                else:
-                    command = (0, 0, 0)
-                # print(f'{command=}')
-                command_list.append(command)
-                agg_commands = np.asarray(command_list[last_idx:])
-                curr_command = np.average(agg_commands, axis=0)
-
-                text = f'{curr_command}'
-                draw_text(image, text, font, control_pos, font_scale, font_thickness, text_color, text_color_bg)
-                draw_text(image, f'{qr_control=}', font, manual_pos, font_scale, font_thickness, text_color, text_color_bg)
-
-                counter = len(agg_commands)
-                if counter >= buffer_len:
-                    if qr_control:
-                        for axis_command, drone_command in zip(curr_command, command_map):
-                            drone_command = drone_command[0] if axis_command > 0 else drone_command[1]
-                            drone_command(int(axis_command * speed))
-                    last_idx = len(command_list)
-                cv2.imshow('Original', image)
-                cv2.waitKey(1)
-
-                if frame.time_base < 1.0 / 60:
-                    time_base = 1.0 / 60
-                else:
-                    time_base = frame.time_base
-                frame_skip = int((time.time() - start_time) / time_base)
+            # always work on the freshest decoded frame, however long the last one took
+            latest = decoder.get_latest_frame(newer_than=frame_num)
+            if latest is None:
+                time.sleep(0.001)
+                continue
+            frame_num, image, decode_time = latest
+
+            frame_cache = FrameCache(image)
+            detected, points, info, qr_frame = qr_tracker.track(frame_cache)
+            if detected:
+                # get center of all points
+                # draw circle around QR code
+                points = np.array(points[0])
+                x_points = points[:, 0]
+                y_points = points[:, 1]
+                area = poly_area(x_points, y_points)
+                size_proportion = area / prev_area
+                if size_proportion < 0.5:
+                    print(f'{area=} | {size_proportion=}')
+
+                prev_points, next_points = optical_flow.update(frame_cache)
+
+                center = tuple(np.mean(points, axis=0).astype(int))
+                cv2.circle(image, center, rad, color=(255, 0, 0), thickness=2)
+
+                prev_area = area
+
+                command = flow_to_commands(prev_points, next_points, size_proportion)
+            else:
+                command = (0, 0, 0)
+            # print(f'{command=}')
+            command_list.append(command)
+            agg_commands = np.asarray(command_list[last_idx:])
+            curr_command = np.average(agg_commands, axis=0)
+
+            text = f'{curr_command}'
+            draw_text(image, text, font, control_pos, font_scale, font_thickness, text_color, text_color_bg)
+            draw_text(image, f'{qr_control=}', font, manual_pos, font_scale, font_thickness, text_color, text_color_bg)
+
+            counter = len(agg_commands)
+            if counter >= buffer_len:
+                if qr_control:
+                    for axis_command, drone_command in zip(curr_command, command_map):
+                        drone_command = drone_command[0] if axis_command > 0 else drone_command[1]
+                        drone_command(int(axis_command * speed))
+                last_idx = len(command_list)
+            cv2.imshow('Original', image)
+            cv2.waitKey(1)
         cv2.destroyAllWindows()
         print(f'video exiting')
         return
@@ -145,15 +135,8 @@ def main():
     # set up connection for drone and wait for video to be ready
     drone.connect()
     drone.wait_for_connection(60.0)
-    retry = 3
-    container = None
-    while container is None and 0 < retry:
-        retry -= 1
-        try:
-            container = av.open(drone.get_video_stream())
-        except av.AVError as ave:
-            print(ave)
-            print('retry...')
+    decoder = LatestFrameDecoder(drone.get_video_stream())
+    decoder.start()
 
     video_thread.start()
     while running:
@@ -165,6 +148,7 @@ def main():
                 print('+' + pygame.key.name(event.key))
                 keyname = pygame.key.name(event.key)
                 if keyname == 'escape':
+                    decoder.stop()
                     drone.quit()
                     exit(0)
                 elif keyname == 'z':
@@ -186,6 +170,7 @@ def main():
                         getattr(drone, key_handler)(0)
                     else:
                         key_handler(drone, 0)
+    decoder.stop()
     drone.quit()
     return
 
@@ -11,7 +11,8 @@ from pathlib import Path
 import cv2
 import numpy as np
 
-from aotd.cv import detect_qr, dense_optical_flow, vectors_to_commands, poly_area, draw_text
+from aotd.cv import FrameCache, QRTracker, flow_roi, roi_optical_flow, roi_flow_to_frame, vectors_to_commands, \
+    poly_area, draw_text
 from aotd.project_properties import data_dir
 
 
@@ -45,15 +46,18 @@ def main(main_args):
         ret = False
         while not ret:
             ret, prev_image = cap.read()
+        prev_frame_cache = FrameCache(prev_image)
 
         true_info = r'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+        qr_tracker = QRTracker()
         rad = 50
         prev_area = 5000
         while cap.isOpened() and not stopped:
             ret, image = cap.read()
             if ret:
                 empty_image = np.zeros_like(image)
-                detected, points, info, qr_frame = detect_qr(image)
+                frame_cache = FrameCache(image)
+                detected, points, info, qr_frame = qr_tracker.track(frame_cache)
                 if points is not None:
                     # get center of all points
                     # draw circle around QR code
@@ -68,13 +72,16 @@ def main(main_args):
                     center = tuple(np.mean(points, axis=0).astype(int))
                     cv2.circle(image, center, rad, color=(255, 0, 0), thickness=2)
 
-                    flow, x_vectors, y_vectors = dense_optical_flow(prev_image, curr_frame=image)
+                    roi = flow_roi(center, rad, image.shape)
+                    flow, x_vectors, y_vectors, roi = roi_optical_flow(prev_frame_cache, frame_cache, roi)
 
                     prev_image = image
+                    prev_frame_cache = frame_cache
                     prev_area = area
 
-                    command = vectors_to_commands(x_vectors, y_vectors, size_proportion, center, rad)
+                    command = vectors_to_commands(x_vectors, y_vectors, size_proportion)
 
+                    flow = roi_flow_to_frame(flow, roi, image.shape)
                     mag, ang = cv2.cartToPolar(flow[..., 0], flow[..., 1])
 
                     hsv = np.zeros_like(image)
@@ -0,0 +1,64 @@
+"""
+@title
+
+@description
+
+Checks the crc functions against the bytewise crc16 reference implementation
+and times them on stick-command sized packets and 1 KB file fragments.
+
+"""
+import argparse
+import os
+import timeit
+
+from aotd.tellopy import crc
+
+
+def check(num_buffers):
+    for length in list(range(0, 40)) + [1024, 1031]:
+        for _ in range(num_buffers):
+            buf = bytearray(os.urandom(length))
+            assert crc.crc16(buf) == crc.crc16_bytewise(buf)
+            assert crc.crc16(memoryview(buf)[1:]) == crc.crc16_bytewise(buf[1:])
+            assert crc.crc16(buf[5:], crc.crc16(buf[:5])) == crc.crc16(buf)
+    buffers = [os.urandom(11) for _ in range(100)] + [os.urandom(1024) for _ in range(100)]
+    assert crc.crc8_batch(buffers) == [crc.crc8(buf) for buf in buffers]
+    assert crc.crc16_batch(buffers) == [crc.crc16_bytewise(buf) for buf in buffers]
+    print('crc check passed')
+    return
+
+
+def bench(length, batch_size, number):
+    buf = bytearray(os.urandom(length))
+    buffers = [os.urandom(length) for _ in range(batch_size)]
+    timings = [
+        ('crc16_bytewise', lambda: crc.crc16_bytewise(buf), 1),
+        ('crc16', lambda: crc.crc16(buf), 1),
+        ('crc16_batch x%d' % batch_size, lambda: crc.crc16_batch(buffers), batch_size),
+        ('crc8', lambda: crc.crc8(buf), 1),
+        ('crc8 x%d' % batch_size, lambda: [crc.crc8(each) for each in buffers], batch_size),
+        ('crc8_batch x%d' % batch_size, lambda: crc.crc8_batch(buffers), batch_size),
+    ]
+    print(f'{length} byte buffers')
+    for name, func, per_call in timings:
+        repeat = max(1, number // per_call)
+        elapsed = min(timeit.repeat(func, number=repeat, repeat=3))
+        print(f'    {name:<24} {elapsed / (repeat * per_call) * 1e6:8.2f} us/buffer')
+    return
+
+
+def main(main_args):
+    check(main_args['num_buffers'])
+    bench(11, main_args['batch_size'], main_args['number'])
+    bench(1024, main_args['batch_size'], main_args['number'] // 10)
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('--num_buffers', type=int, default=20)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--number', type=int, default=20000)
+
+    args = parser.parse_args()
+    main(vars(args))
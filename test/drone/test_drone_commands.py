@@ -8,7 +8,7 @@ import time
 
 import numpy as np
 
-from aotd.cv import detect_qr, vectors_to_commands, dense_optical_flow, poly_area, draw_text
+from aotd.cv import FrameCache, QRTracker, flow_to_commands, SparseFlow, poly_area, draw_text
 from aotd.tellopy import logger
 from aotd.tellopy.tello import Tello
 
@@ -49,20 +49,21 @@ def main():
 
         rad = 50
         true_info = r'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+        qr_tracker = QRTracker()
+        optical_flow = SparseFlow()
         while video_running:
             print('video running')
             for frame in container.decode(video=0):
                 if 0 < frame_skip:
                     frame_skip = frame_skip - 1
-                    prev_image = frame.to_image()
-                    prev_image = cv2.cvtColor(numpy.array(prev_image), cv2.COLOR_RGB2BGR)
                     continue
                 start_time = time.time()
 
                 video_frame = frame.to_image()
                 image = cv2.cvtColor(numpy.array(video_frame), cv2.COLOR_RGB2BGR)
 
-                detected, points, info, qr_frame = detect_qr(image)
+                frame_cache = FrameCache(image)
+                detected, points, info, qr_frame = qr_tracker.track(frame_cache)
                 if detected and info == true_info:
                     # get center of all points
                     # draw circle around QR code
@@ -74,15 +75,14 @@ def main():
                     if size_proportion < 0.5:
                         print(f'{area=} | {size_proportion=}')
 
+                    prev_points, next_points = optical_flow.update(frame_cache)
+
                     center = tuple(np.mean(points, axis=0).astype(int))
                     cv2.circle(image, center, rad, color=(255, 0, 0), thickness=2)
 
-                    flow, x_vectors, y_vectors = dense_optical_flow(prev_image, curr_frame=image)
-
-                    prev_image = image
                     prev_area = area
 
-                    command = vectors_to_commands(x_vectors, y_vectors, size_proportion, center, rad)
+                    command = flow_to_commands(prev_points, next_points, size_proportion)
                 else:
                     command = (0, 0, 0)
                 print(f'{command=}')
@@ -1,11 +1,10 @@
 import sys
 import traceback
-import av
 import cv2 as cv2  # for avoidance of pylint error
-import numpy
 import time
 
 from aotd.tellopy.tello import Tello
+from aotd.video import LatestFrameDecoder
 
 
 def main():
@@ -15,32 +14,18 @@ def main():
         drone.connect()
         drone.wait_for_connection(60.0)
 
-        retry = 3
-        container = None
-        while container is None and 0 < retry:
-            retry -= 1
-            try:
-                container = av.open(drone.get_video_stream())
-            except av.AVError as ave:
-                print(ave)
-                print('retry...')
-
-        # skip first 300 frames
-        frame_skip = 300
+        decoder = LatestFrameDecoder(drone.get_video_stream())
+        decoder.start()
+
+        frame_num = None
         while True:
-            for frame in container.decode(video=0):
-                if 0 < frame_skip:
-                    frame_skip = frame_skip - 1
-                    continue
-                start_time = time.time()
-                image = cv2.cvtColor(numpy.array(frame.to_image()), cv2.COLOR_RGB2BGR)
-                cv2.imshow('Original', image)
-                cv2.waitKey(1)
-                if frame.time_base < 1.0 / 60:
-                    time_base = 1.0 / 60
-                else:
-                    time_base = frame.time_base
-                frame_skip = int((time.time() - start_time) / time_base)
+            latest = decoder.get_latest_frame(newer_than=frame_num)
+            if latest is None:
+                time.sleep(0.001)
+                continue
+            frame_num, image, decode_time = latest
+            cv2.imshow('Original', image)
+            cv2.waitKey(1)
     except Exception as ex:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         traceback.print_exception(exc_type, exc_value, exc_traceback)
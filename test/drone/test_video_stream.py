@@ -0,0 +1,149 @@
+"""
+@title
+
+@description
+
+Feeds hand-built VideoData packets through VideoStream and checks what reaches
+the reader: frames that lost a packet, frames dropped at the high-water mark and
+the resync on the next IDR frame, also after whole frames went missing. No drone is
+needed.
+
+"""
+import argparse
+
+from aotd.tellopy import logger
+from aotd.tellopy.tello import Tello
+from aotd.tellopy.video_stream import VideoStream
+
+# NAL headers: nal_ref_idc in bits 5-6, type in bits 0-4
+IDR = 0x65
+P_REF = 0x41
+B_NONREF = 0x01
+
+
+class FakeDrone(object):
+    EVENT_CONNECTED = Tello.EVENT_CONNECTED
+    EVENT_DISCONNECTED = Tello.EVENT_DISCONNECTED
+    EVENT_VIDEO_DATA = Tello.EVENT_VIDEO_DATA
+
+    def __init__(self):
+        self.log = logger.Logger('FakeDrone')
+        self.log.set_level(logger.LOG_WARN)
+        self.handlers = []
+        self.keyframe_requests = 0
+
+    def subscribe(self, signal, handler):
+        self.handlers.append((signal, handler))
+
+    def start_video(self):
+        self.keyframe_requests += 1
+
+    def send(self, data):
+        for signal, handler in self.handlers:
+            if signal is Tello.EVENT_VIDEO_DATA:
+                handler(Tello.EVENT_VIDEO_DATA, self, data)
+
+
+def packets(seq, nal, size, count):
+    """A frame of count packets, the first starting with a NAL unit of header nal."""
+    body = b'\x00\x00\x00\x01' + bytes([nal]) + bytes([seq]) * (size * count - 5)
+    return [bytes([seq, index | (0x80 if index == count - 1 else 0)]) + body[index * size:(index + 1) * size]
+            for index in range(count)]
+
+
+def send_frame(drone, seq, nal, size=100, count=2, skip=None):
+    for index, packet in enumerate(packets(seq, nal, size, count)):
+        if index != skip:
+            drone.send(packet)
+
+
+def queued(stream):
+    return [frame.seq for frame in stream.frames if frame.queued]
+
+
+def check_loss():
+    drone = FakeDrone()
+    stream = VideoStream(drone)
+    send_frame(drone, 0, IDR)
+    send_frame(drone, 1, P_REF, count=3, skip=1)
+    send_frame(drone, 2, P_REF)
+    send_frame(drone, 3, P_REF)
+    assert stream.wait_keyframe and drone.keyframe_requests == 1
+    assert queued(stream) == [0] and stream.lost_frames == 1
+    send_frame(drone, 4, IDR)
+    send_frame(drone, 5, P_REF)
+    assert not stream.wait_keyframe and queued(stream) == [0, 4, 5]
+    assert len(stream.read(10000)) == 3 * 200
+
+    # losing a frame nothing refers to costs only that frame
+    drone = FakeDrone()
+    stream = VideoStream(drone)
+    send_frame(drone, 0, IDR)
+    send_frame(drone, 1, B_NONREF, count=3, skip=1)
+    send_frame(drone, 2, P_REF)
+    assert not stream.wait_keyframe and drone.keyframe_requests == 0
+    assert queued(stream) == [0, 2] and stream.lost_frames == 1
+
+    # a frame that lost every packet shows up only as a gap in the sequence numbers
+    drone = FakeDrone()
+    stream = VideoStream(drone)
+    send_frame(drone, 0, IDR)
+    send_frame(drone, 1, P_REF, count=1)
+    send_frame(drone, 3, P_REF, count=1)
+    send_frame(drone, 4, P_REF, count=1)
+    assert stream.wait_keyframe and drone.keyframe_requests == 1
+    assert queued(stream) == [0, 1] and stream.lost_frames == 1
+    send_frame(drone, 5, IDR)
+    assert not stream.wait_keyframe and queued(stream) == [0, 1, 5]
+    # the sequence byte wraps around without counting as a gap
+    for seq in (254, 255, 0, 1):
+        send_frame(drone, seq, IDR if seq == 254 else P_REF, count=1)
+    assert queued(stream)[-4:] == [254, 255, 0, 1] and stream.lost_frames == 1 + 248
+    print('loss check passed')
+
+
+def check_high_water():
+    drone = FakeDrone()
+    stream = VideoStream(drone, capacity=4096, high_water=900)
+    for seq in range(5):
+        send_frame(drone, seq, IDR if seq == 0 else P_REF)
+    assert len(stream.ring) == 1000 and queued(stream) == [0, 1, 2, 3, 4]
+    # over the mark a non-reference frame is dropped without a keyframe request
+    send_frame(drone, 5, B_NONREF)
+    assert drone.keyframe_requests == 0 and stream.dropped_frames == 1
+    # a reference frame has to go, so everything up to the next IDR goes with it
+    send_frame(drone, 6, P_REF)
+    assert stream.wait_keyframe and drone.keyframe_requests == 1
+    stream.read(10000)
+    send_frame(drone, 7, P_REF)
+    assert queued(stream)[-1] == 4 and stream.dropped_frames == 3
+    send_frame(drone, 8, IDR)
+    send_frame(drone, 9, P_REF)
+    assert not stream.wait_keyframe and queued(stream)[-2:] == [8, 9]
+    assert len(stream.read(10000)) == 400
+    print('high water check passed')
+
+
+def check_partial_frame():
+    drone = FakeDrone()
+    stream = VideoStream(drone)
+    first, second = packets(0, IDR, 100, 2)
+    drone.send(first)
+    assert len(stream.ring) == 0, 'a frame must not be readable before it is complete'
+    drone.send(second)
+    data = stream.read(150)
+    assert isinstance(data, bytes) and len(data) == 150 and data.startswith(b'\x00\x00\x00\x01\x65')
+    print('partial frame check passed')
+
+
+def main(main_args):
+    check_loss()
+    check_high_water()
+    check_partial_frame()
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='')
+    args = parser.parse_args()
+    main(vars(args))